@@ -33,9 +33,13 @@ here = path.abspath(path.dirname(__file__))
 install_requires = ['requests']
 cmdclass = {}
 
+if sys.version_info < (3,2):
+    # backport of `concurrent.futures`
+    install_requires += ['futures']
+
 if PY_34:
     # one more dependency for Python 3.4
-    install_requires += ['aiohttp']
+    install_requires += ['aiohttp>=2.0']
 else:
     # do not copy/compile async module for Python 3.3 or below
     cmdclass['build_py'] = nocopy_async
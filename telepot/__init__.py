@@ -1,12 +1,13 @@
-import sys
-import io
+import re
 import time
-import json
 import requests
 import threading
 import traceback
 import collections
 import warnings
+import telepot.ratelimit
+import telepot.cache
+import telepot.codec
 
 try:
     from Queue import Queue
@@ -203,8 +204,8 @@ class BadHTTPResponse(TelepotException):
         return self.args[1]
 
 class TelegramError(TelepotException):
-    def __init__(self, description, error_code):
-        super(TelegramError, self).__init__(description, error_code)
+    def __init__(self, description, error_code, parameters=None):
+        super(TelegramError, self).__init__(description, error_code, parameters)
 
     @property
     def description(self):
@@ -214,58 +215,212 @@ class TelegramError(TelepotException):
     def error_code(self):
         return self.args[1]
 
+    @property
+    def parameters(self):
+        return self.args[2]
+
+    # Seconds to wait before repeating a request refused with error 429
+    @property
+    def retry_after(self):
+        if self.parameters and 'retry_after' in self.parameters:
+            return self.parameters['retry_after']
+
+        # Older responses only mention it in the description, e.g. 'Too Many Requests: retry after 5'
+        m = re.search(r'retry after (\d+)', self.description or '')
+        return int(m.group(1)) if m else None
+
+
+# Create a `requests.Session` backed by a connection pool, to be given to one or more bots.
+# - pool_connections: number of hosts to keep a pool for
+# - pool_maxsize: number of connections kept alive per host. Should be at least the number of
+#   threads calling the bot concurrently, otherwise surplus connections are opened and discarded.
+# - pool_block: never open more than `pool_maxsize` connections per host. Surplus callers
+#   wait for a free connection instead.
+# - keep_alive: if False, close connection after every request.
+def create_session(pool_connections=10, pool_maxsize=10, pool_block=False, keep_alive=True):
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(pool_connections=pool_connections, pool_maxsize=pool_maxsize, pool_block=pool_block)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+
+    if not keep_alive:
+        session.headers['Connection'] = 'close'
+
+    return session
+
 
 class Bot(object):
-    def __init__(self, token):
+    def __init__(self, token, session=None, scheduler=None, retry=None, markup_cache_size=0, codec=None, file_id_cache=None, response_cache=None, media_cache=None, base_url='https://api.telegram.org'):
         self._token = token
+
+        # Where the Bot API is served. Point it at a local server, e.g. `telepot.fakeapi.FakeBotAPI`,
+        # to test or benchmark without Telegram.
+        self._base_url = base_url.rstrip('/')
         self._msg_thread = None
+        self._offset_tracker = None
 
         # Ensure an exception is raised for requests that take too long
         self._http_timeout = 30
 
-        # For streaming file download
+        # For streaming file download and upload
         self._file_chunk_size = 65536
 
+        # Uploads are given `_http_timeout`, plus as much time as it takes to send the file
+        # at this many bytes per second.
+        self._upload_min_rate = 16384
+
+        # Keep connections alive across API calls. The session's connection pool is
+        # thread-safe, so message thread and delegate threads can share it. If a session
+        # is supplied (possibly shared by several bots), the caller owns it.
+        if session is None:
+            self._session = create_session()
+            self._own_session = True
+        else:
+            self._session = session
+            self._own_session = False
+
+        # Paces outgoing messages to stay within Telegram's flood limits.
+        # May be shared by several bots using the same token.
+        self._scheduler = scheduler
+
+        # Repeats calls that fail for transient reasons. Should be a `telepot.retry.RetryPolicy`.
+        self._retry = retry
+
+        # Parses responses and serializes parameters. Picks the fastest JSON library installed
+        # unless told otherwise, e.g. `codec=telepot.codec.get('json')`.
+        self._codec = codec if codec is not None else telepot.codec.get()
+
+        # Remember the JSON form of keyboards sent over and over. Off by default, because
+        # a `reply_markup` object must not be modified once it has been sent.
+        if markup_cache_size:
+            self._markup_cache = telepot.cache.SerializationCache(self._dumps, markup_cache_size)
+        else:
+            self._markup_cache = None
+
+        # Send content uploaded before by the file_id Telegram gave it, instead of uploading
+        # it again. Should be a `telepot.cache.FileIdCache`.
+        self._file_id_cache = file_id_cache
+
+        # Keep results of read-only calls like `getFile` for a while. Should be a
+        # `telepot.cache.ResponseCache`.
+        self._response_cache = response_cache
+
+        # Keep downloaded files on disk, to be served again without going to Telegram.
+        # Should be a `telepot.cache.MediaCache`.
+        self._media_cache = media_cache
+
+    @property
+    def session(self):
+        return self._session
+
+    @property
+    def scheduler(self):
+        return self._scheduler
+
+    @property
+    def retry(self):
+        return self._retry
+
+    @property
+    def codec(self):
+        return self._codec
+
+    @property
+    def file_id_cache(self):
+        return self._file_id_cache
+
+    @property
+    def response_cache(self):
+        return self._response_cache
+
+    @property
+    def media_cache(self):
+        return self._media_cache
+
+    def close(self):
+        if self._own_session:
+            self._session.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        self.close()
+
     def _fileurl(self, path):
-        return 'https://api.telegram.org/file/bot%s/%s' % (self._token, path)
+        return '%s/file/bot%s/%s' % (self._base_url, self._token, path)
 
     def _methodurl(self, method):
-        return 'https://api.telegram.org/bot%s/%s' % (self._token, method)
+        return '%s/bot%s/%s' % (self._base_url, self._token, method)
 
     def _parse(self, response):
         try:
-            data = response.json()
+            data = self._codec.loads(response.content)
         except ValueError:  # No JSON object could be decoded
             raise BadHTTPResponse(response.status_code, response.text)
 
         if data['ok']:
             return data['result']
         else:
-            raise TelegramError(data['description'], data['error_code'])
+            raise TelegramError(data['description'], data['error_code'], data.get('parameters'))
+
+    def _dumps(self, value):
+        return self._codec.dumps(value)
 
     def _rectify(self, params):
         # remove None, then json-serialize if needed
-        return {key: value if type(value) not in [dict, list] else json.dumps(value, separators=(',',':')) for key,value in params.items() if value is not None}
+        dumps = self._markup_cache.dumps if self._markup_cache else self._dumps
+        return {key: value if type(value) not in (dict, list) else dumps(value) for key,value in params.items() if value is not None}
+
+    # Make one attempt at calling `method`
+    def _post(self, method, params, files, **kwargs):
+        if self._scheduler and method in telepot.ratelimit.SEND_METHODS:
+            self._scheduler.acquire(params['chat_id'])
+
+        # Parameters go in the request body, not the URL, so long texts do not hit URL length limits.
+        if files:
+            # Stream the multipart body, rather than letting `requests` build it in memory.
+            deadline = time.time() + kwargs['timeout'] if kwargs['timeout'] is not None else None
+            body = telepot.upload.MultipartStream(self._rectify(params or {}), files, self._file_chunk_size, deadline)
+            r = self._session.post(self._methodurl(method), data=body, headers={'Content-Type': body.content_type}, **kwargs)
+        else:
+            r = self._session.post(self._methodurl(method), data=self._rectify(params or {}), **kwargs)
 
-    def getMe(self):
-        r = requests.post(self._methodurl('getMe'), timeout=self._http_timeout)
         return self._parse(r)
 
+    def _upload_timeout(self, files):
+        return self._http_timeout + sum([f.size for f in files.values()]) / float(self._upload_min_rate)
+
+    def _api_request(self, method, params=None, files=None, **kwargs):
+        cache = self._response_cache
+        if cache is None or not cache.caches(method):
+            return self._call(method, params, files, **kwargs)
+
+        return cache.fetch(cache.key(method, params), lambda: self._call(method, params, files, **kwargs))
+
+    def _call(self, method, params=None, files=None, **kwargs):
+        if files:
+            # An `InputFile` reads from the same position on every attempt.
+            files = {k: f if isinstance(f, telepot.upload.InputFile) else telepot.upload.InputFile(f) for k,f in files.items()}
+            kwargs.setdefault('timeout', self._upload_timeout(files))
+        else:
+            kwargs.setdefault('timeout', self._http_timeout)
+
+        if self._retry is None:
+            return self._post(method, params, files, **kwargs)
+        else:
+            return self._retry.call(method, self._post, method, params, files, **kwargs)
+
+    def getMe(self):
+        return self._api_request('getMe')
+
     def sendMessage(self, chat_id, text, parse_mode=None, disable_web_page_preview=None, reply_to_message_id=None, reply_markup=None):
         p = {'chat_id': chat_id, 'text': text, 'parse_mode': parse_mode, 'disable_web_page_preview': disable_web_page_preview, 'reply_to_message_id': reply_to_message_id, 'reply_markup': reply_markup}
-        r = requests.post(self._methodurl('sendMessage'), params=self._rectify(p), timeout=self._http_timeout)
-        return self._parse(r)
+        return self._api_request('sendMessage', p)
 
     def forwardMessage(self, chat_id, from_chat_id, message_id):
         p = {'chat_id': chat_id, 'from_chat_id': from_chat_id, 'message_id': message_id}
-        r = requests.post(self._methodurl('forwardMessage'), params=self._rectify(p), timeout=self._http_timeout)
-        return self._parse(r)
-
-    def _isfile(self, f):
-        if sys.version_info.major >= 3:
-            return isinstance(f, io.IOBase)
-        else:
-            return type(f) is file
+        return self._api_request('forwardMessage', p)
 
     def _sendFile(self, inputfile, filetype, params):
         method = {'photo':    'sendPhoto',
@@ -275,18 +430,39 @@ class Bot(object):
                   'video':    'sendVideo',
                   'voice':    'sendVoice',}[filetype]
 
-        if self._isfile(inputfile):
-            files = {filetype: inputfile}
-            r = requests.post(self._methodurl(method), params=self._rectify(params), files=files)
+        if telepot.upload.is_content(inputfile):
+            if self._file_id_cache is None:
+                files = {filetype: inputfile}
 
-            # `self._http_timeout` is not used here because, for some reason, the larger the file, 
-            # the longer it takes for the server to respond (after upload is finished). It is hard to say
-            # what value `self._http_timeout` should be. In the future, maybe I should let user specify.
+                # The larger the file, the longer it takes for the server to respond (after upload
+                # is finished), so the timeout grows with file size. See `_upload_timeout()`.
+                return self._api_request(method, params, files)
+            else:
+                return self._sendCachedFile(method, inputfile, filetype, params)
         else:
             params[filetype] = inputfile
-            r = requests.post(self._methodurl(method), params=self._rectify(params), timeout=self._http_timeout)
+            return self._api_request(method, params)
 
-        return self._parse(r)
+    def _sendCachedFile(self, method, inputfile, filetype, params):
+        f = inputfile if isinstance(inputfile, telepot.upload.InputFile) else telepot.upload.InputFile(inputfile)
+        key = telepot.upload.cache_key(f, filetype)
+
+        file_id = self._file_id_cache.get(key)
+        if file_id is not None:
+            try:
+                return self._api_request(method, dict(params, **{filetype: file_id}))
+            except TelegramError as e:
+                if not telepot.upload.file_id_refused(e):
+                    raise
+                self._file_id_cache.pop(key)  # file_id expired, upload again
+
+        msg = self._api_request(method, params, {filetype: f})
+
+        file_id = telepot.upload.sent_file_id(msg, filetype)
+        if file_id is not None:
+            self._file_id_cache.put(key, file_id)
+
+        return msg
 
     def sendPhoto(self, chat_id, photo, caption=None, reply_to_message_id=None, reply_markup=None):
         return self._sendFile(photo, 'photo', {'chat_id': chat_id, 'caption': caption, 'reply_to_message_id': reply_to_message_id, 'reply_markup': reply_markup})
@@ -308,74 +484,81 @@ class Bot(object):
 
     def sendLocation(self, chat_id, latitude, longitude, reply_to_message_id=None, reply_markup=None):
         p = {'chat_id': chat_id, 'latitude': latitude, 'longitude': longitude, 'reply_to_message_id': reply_to_message_id, 'reply_markup': reply_markup}
-        r = requests.post(self._methodurl('sendLocation'), params=self._rectify(p), timeout=self._http_timeout)
-        return self._parse(r)
+        return self._api_request('sendLocation', p)
 
     def sendChatAction(self, chat_id, action):
         p = {'chat_id': chat_id, 'action': action}
-        r = requests.post(self._methodurl('sendChatAction'), params=self._rectify(p), timeout=self._http_timeout)
-        return self._parse(r)
+        return self._api_request('sendChatAction', p)
 
     def getUserProfilePhotos(self, user_id, offset=None, limit=None):
         p = {'user_id': user_id, 'offset': offset, 'limit': limit}
-        r = requests.post(self._methodurl('getUserProfilePhotos'), params=self._rectify(p), timeout=self._http_timeout)
-        return self._parse(r)
+        return self._api_request('getUserProfilePhotos', p)
 
     def getFile(self, file_id):
         p = {'file_id': file_id}
-        r = requests.post(self._methodurl('getFile'), params=self._rectify(p), timeout=self._http_timeout)
-        return self._parse(r)
+        return self._api_request('getFile', p)
 
     def getUpdates(self, offset=None, limit=None, timeout=None):
         p = {'offset': offset, 'limit': limit, 'timeout': timeout}
-        r = requests.post(self._methodurl('getUpdates'), params=self._rectify(p), timeout=self._http_timeout+(0 if timeout is None else timeout))
-        return self._parse(r)
+        return self._api_request('getUpdates', p, timeout=self._http_timeout+(0 if timeout is None else timeout))
 
     def setWebhook(self, url=None, certificate=None):
         p = {'url': url}
 
         if certificate:
             files = {'certificate': certificate}
-            r = requests.post(self._methodurl('setWebhook'), params=self._rectify(p), files=files, timeout=self._http_timeout)
+            return self._api_request('setWebhook', p, files)
         else:
-            r = requests.post(self._methodurl('setWebhook'), params=self._rectify(p), timeout=self._http_timeout)
+            return self._api_request('setWebhook', p)
 
-        return self._parse(r)
+    def downloadFile(self, file_id, dest, parallel=1):
+        if self._media_cache is None:
+            self._downloadFile(file_id, dest, parallel)
+        else:
+            with self._media_cache.fetch(file_id, lambda path: self._downloadFile(file_id, path, parallel)) as f:
+                telepot.download.copy(f, dest, self._file_chunk_size)
 
-    def downloadFile(self, file_id, dest):
+    def _downloadFile(self, file_id, dest, parallel):
         f = self.getFile(file_id)
 
         # `file_path` is optional in File object
         if 'file_path' not in f:
             raise TelegramError('No file_path returned', None)
 
-        try:
-            r = requests.get(self._fileurl(f['file_path']), stream=True, timeout=self._http_timeout)
+        # `dest` may be a path, a file object, or a writable buffer such as a bytearray or mmap.
+        # A broken connection is resumed where it left off.
+        telepot.download.download(self._session, self._fileurl(f['file_path']), dest, f.get('file_size'),
+                                  self._file_chunk_size, self._http_timeout, parallel)
 
-            d = dest if self._isfile(dest) else open(dest, 'wb')
+    def streamFile(self, file_id, chunk_size=None):
+        f = self.getFile(file_id)
+
+        # `file_path` is optional in File object
+        if 'file_path' not in f:
+            raise TelegramError('No file_path returned', None)
+
+        return telepot.download.chunks(self._session, self._fileurl(f['file_path']), f.get('file_size'),
+                                       chunk_size or self._file_chunk_size, self._http_timeout)
 
-            for chunk in r.iter_content(chunk_size=self._file_chunk_size):
-                if chunk:
-                    d.write(chunk)
-                    d.flush()
-        finally:
-            if not self._isfile(dest) and 'd' in locals():
-                d.close()
+    def broadcast(self, chat_ids, text, parse_mode=None, disable_web_page_preview=None, reply_markup=None, workers=8, checkpoint=None):
+        p = {'text': text, 'parse_mode': parse_mode, 'disable_web_page_preview': disable_web_page_preview, 'reply_markup': reply_markup}
 
-            if 'r' in locals():
-                r.close()
+        # Serialize once, not once per recipient.
+        return telepot.broadcast.broadcast(self, chat_ids, self._rectify(p), workers, checkpoint)
 
-    def notifyOnMessage(self, callback=None, relax=0.1, timeout=20, run_forever=False):
+    def notifyOnMessage(self, callback=None, relax=0.1, timeout=20, run_forever=False, workers=1, maxsize=1000, offset_store=None, recorder=None):
         if callback is None:
             callback = self.handle
 
         # For MessageThread to call outer class getUpdates()
-        def get_updates(offset, timeout):
-            return self.getUpdates(offset=offset, timeout=timeout)
-
-        # This is the thread that constantly calls getUpdates() and applies callback function
-        # to messages. The main thread sets the params (callback, relax, timeout), and this
-        # thread just applies those params.
+        def get_updates(offset, limit, timeout):
+            return self.getUpdates(offset=offset, limit=limit, timeout=timeout)
+
+        # This is the thread that constantly calls getUpdates() and hands updates to `workers`
+        # threads, called lanes, which apply the callback function. Messages of a chat always
+        # go to the same lane, so they are handled in order. Fetching never waits for a slow
+        # callback, unless the lane is full. The main thread sets the params (callback, relax,
+        # timeout), and this thread just applies those params.
         #
         # A Bot has at most one MessageThread. If `callback` is set to None (cancelled), 
         # the MessageThread will die. If `callback` is then set to non-None, a new MessageThread 
@@ -386,60 +569,104 @@ class Bot(object):
         # Scroll down to see their designed interactions.
 
         class MessageThread(threading.Thread):
-            def __init__(self, callback, relax, timeout):
+            def __init__(self, callback, relax, timeout, workers, maxsize, tracker, recorder):
                 super(MessageThread, self).__init__()
                 self.set(callback, relax, timeout)
                 self.lock = threading.Lock()
                 self.dying = False
+                self.workers = workers
+                self.maxsize = maxsize
+                self.tracker = tracker
+                self.recorder = recorder
+                self.executor = telepot.executor.OrderedExecutor(workers, -(-maxsize // workers))
 
             def set(self, callback, relax, timeout):
                 self.callback, self.relax, self.timeout = callback, relax, timeout
 
-            def handle(self, update):
+            def handle(self, callback, update):
                 try:
-                    self.callback(update['message'])
+                    callback(update['message'])
                 except:
-                    # Localize the error so message thread can keep going.
+                    # Localize the error so worker thread can keep going.
                     traceback.print_exc()
                 finally:
-                    return update['update_id']
+                    self.tracker.done(update['update_id'])
+
+            # Ask for no more updates than the lanes have room for, but not so few that
+            # polling goes on a few updates at a time while workers catch up.
+            def limit(self):
+                if self.maxsize <= 0:
+                    return 100
+                return max(25, min(100, self.maxsize - self.executor.qsize()))
 
             def run(self):
-                offset = None  # running offset
-                while 1:
-                    try:
-                        with self.lock:
-                            if not self.callback:
-                                self.dying = True
-                                return
-
-                                # Ideally, I should call getUpdates() once more with the latest `offset`
-                                # to acknowledge receiving those messages. But, because main thread may
-                                # spawn a new MessageThread after seeing this one is `dying`, two
-                                # getUpdates() will collide. Solution is, either to put getUpdates()
-                                # within the lock (which causes main thread to block a little bit),
-                                # or make the old and new MessageThread coordinate in some ways.
-                                #
-                                # As of now, some messages may be received twice (if callback is set,
-                                # unset, then set again). Since this usage is not frequent and the problem
-                                # is minor, I decide to leave it for now.
-
-                        result = get_updates(offset=offset, timeout=self.timeout)
-
-                        with self.lock:
-                            if not self.callback:
-                                self.dying = True
-                                return
-
-                            if len(result) > 0:
-                                # No sort. Trust server to give messages in correct order.
-                                # Update offset to max(update_id) + 1
-                                offset = max([self.handle(update) for update in result]) + 1
-                    except:
-                        traceback.print_exc()
-                    finally:
-                        if not self.dying:
+                backlog = False
+                try:
+                    # Updates fetched before a restart, but not handled, go first.
+                    for update in self.tracker.recover():
+                        self.executor.submit(telepot.executor.chat_key(update.get('message')), self.handle, self.callback, update)
+
+                    while 1:
+                        try:
+                            with self.lock:
+                                if not self.callback:
+                                    self.dying = True
+                                    return
+
+                                    # Ideally, I should call getUpdates() once more with the latest `offset`
+                                    # to acknowledge receiving those messages. But, because main thread may
+                                    # spawn a new MessageThread after seeing this one is `dying`, two
+                                    # getUpdates() will collide. Solution is, either to put getUpdates()
+                                    # within the lock (which causes main thread to block a little bit),
+                                    # or make the old and new MessageThread coordinate in some ways.
+                                    #
+                                    # As of now, some messages may be received twice (if callback is set,
+                                    # unset, then set again). The new MessageThread shares this one's
+                                    # `tracker`, which drops them.
+
+                            # If the last batch was full, more updates are probably waiting.
+                            # Fetch them without long-polling.
+                            limit = self.limit()
+                            result = get_updates(offset=self.tracker.offset, limit=limit, timeout=0 if backlog else self.timeout)
+
+                            with self.lock:
+                                if not self.callback:
+                                    self.dying = True
+                                    return
+
+                                callback = self.callback
+
+                            # No sort. Trust server to give messages in correct order.
+                            # Drop updates seen before, which also moves the offset past the rest.
+                            fresh = self.tracker.accept(result)
+
+                            if self.recorder:
+                                for update in fresh:
+                                    self.recorder.write(update)
+
+                            # Block if workers fall behind. Queued updates are handled by the
+                            # callback in effect when they were fetched.
+                            for update in fresh:
+                                self.executor.submit(telepot.executor.chat_key(update.get('message')), self.handle, callback, update)
+
+                            backlog = len(fresh) > 0 and len(result) >= limit
+                        except:
+                            traceback.print_exc()
+                            backlog = False
                             time.sleep(self.relax)
+                        else:
+                            # Relax only when there is nothing to do.
+                            if not fresh:
+                                time.sleep(self.relax)
+                finally:
+                    # Workers finish what is queued, then exit.
+                    self.executor.shutdown(wait=False)
+
+        # Successive MessageThreads share a tracker, unless the offset store changes.
+        def tracker(store):
+            if self._offset_tracker is None or self._offset_tracker.store is not store:
+                self._offset_tracker = telepot.offset.OffsetTracker(store)
+            return self._offset_tracker
 
         # Interaction between main thread and message thread
         # - Message thread: check `callback` to determine `dying` (No callback leads to death)
@@ -451,15 +678,20 @@ class Bot(object):
             with self._msg_thread.lock:
                 if callback and self._msg_thread.dying:
                     # Spawn new message thread
-                    self._msg_thread = MessageThread(callback, relax, timeout)
+                    self._msg_thread = MessageThread(callback, relax, timeout, workers, maxsize, tracker(offset_store), recorder)
                     self._msg_thread.daemon = True
                     self._msg_thread.start()
                 else:
+                    # Lanes, queue, store and recorder are fixed for the thread's life.
+                    t = self._msg_thread
+                    if not t.dying and (workers != t.workers or maxsize != t.maxsize or offset_store is not t.tracker.store or recorder is not t.recorder):
+                        raise ValueError('Cannot change workers, maxsize, offset_store or recorder of a running message thread')
+
                     # Modify existing message thread's params
                     self._msg_thread.set(callback, relax, timeout)
         elif callback:
             # Spawn new message thread
-            self._msg_thread = MessageThread(callback, relax, timeout)
+            self._msg_thread = MessageThread(callback, relax, timeout, workers, maxsize, tracker(offset_store), recorder)
             self._msg_thread.daemon = True
             self._msg_thread.start()
 
@@ -467,30 +699,57 @@ class Bot(object):
             while 1:
                 time.sleep(10)
 
+    # Receive updates through a webhook instead of polling. No `getUpdates()` round trip
+    # or `relax` sleep stands between a message and its handling.
+    def notifyOnWebhook(self, path, port=8443, host='', certfile=None, keyfile=None, callback=None, run_forever=False, workers=1):
+        if callback is None:
+            callback = self.handle
+
+        server = telepot.webhook.WebhookServer(path, callback, host, port, certfile, keyfile, self._codec, workers=workers)
+        server.start()
+
+        if run_forever:
+            while 1:
+                time.sleep(10)
+
+        return server
+
 
 import inspect
 import telepot.helper
+import telepot.retry
+import telepot.broadcast
+import telepot.upload
+import telepot.download
+import telepot.webhook
+import telepot.executor
+import telepot.offset
 
 
 class SpeakerBot(Bot):
-    def __init__(self, token):
-        super(SpeakerBot, self).__init__(token)
+    def __init__(self, token, listener_queue=None, **kwargs):
+        super(SpeakerBot, self).__init__(token, **kwargs)
         self._mic = telepot.helper.Microphone()
 
+        # Creates each listener's message queue, e.g.
+        # `lambda: telepot.helper.ListenerQueue(100, telepot.helper.DROP_OLDEST)`.
+        # Unbounded queues by default.
+        self._listener_queue = listener_queue
+
     @property
     def mic(self):
         return self._mic
 
     def create_listener(self):
-        q = Queue()
+        q = self._listener_queue() if self._listener_queue else Queue()
         self._mic.add(q)
         ln = telepot.helper.Listener(self._mic, q)
         return ln
 
 
 class DelegatorBot(SpeakerBot):
-    def __init__(self, token, delegation_patterns):
-        super(DelegatorBot, self).__init__(token)
+    def __init__(self, token, delegation_patterns, **kwargs):
+        super(DelegatorBot, self).__init__(token, **kwargs)
         self._delegate_records = [p+({},) for p in delegation_patterns]
 
     def _startable(self, delegate):
@@ -1,65 +1,255 @@
-import io
-import json
 import asyncio
 import aiohttp
 import traceback
 from concurrent.futures._base import CancelledError
 import collections
 import telepot
+import telepot.ratelimit
+import telepot.cache
+import telepot.codec
 import telepot.async.helper
+import telepot.async.broadcast
+import telepot.async.upload
+import telepot.async.download
+import telepot.async.cache
+import telepot.async.webhook
+import telepot.async.executor
+import telepot.offset
+
+
+# Create an `aiohttp.ClientSession` backed by a connection pool, to be given to one or more bots.
+# - limit: total number of simultaneous connections
+# - limit_per_host: number of simultaneous connections to one host, 0 means no limit
+# - keepalive_timeout: seconds to keep an idle connection open for reuse
+# - use_dns_cache, ttl_dns_cache: cache resolved addresses for that many seconds
+def create_session(limit=100, limit_per_host=0, keepalive_timeout=30, use_dns_cache=True, ttl_dns_cache=10, loop=None):
+    connector = aiohttp.TCPConnector(limit=limit,
+                                     limit_per_host=limit_per_host,
+                                     keepalive_timeout=keepalive_timeout,
+                                     use_dns_cache=use_dns_cache,
+                                     ttl_dns_cache=ttl_dns_cache,
+                                     loop=loop)
+    return aiohttp.ClientSession(connector=connector, loop=loop)
 
 
 class Bot(object):
-    def __init__(self, token, loop=None):
+    def __init__(self, token, loop=None, session=None, scheduler=None, retry=None, markup_cache_size=0, codec=None, file_id_cache=None, response_cache=None, media_cache=None, base_url='https://api.telegram.org'):
         self._token = token
+
+        # Where the Bot API is served. Point it at a local server, e.g. `telepot.fakeapi.FakeBotAPI`,
+        # to test or benchmark without Telegram.
+        self._base_url = base_url.rstrip('/')
         self._loop = loop if loop is not None else asyncio.get_event_loop()
 
         self._http_timeout = 30
         self._file_chunk_size = 65536
 
+        # Uploads are given `_http_timeout`, plus as much time as it takes to send the file
+        # at this many bytes per second.
+        self._upload_min_rate = 16384
+
+        # Keep connections alive across API calls, and cap the number of sockets opened
+        # when many delegates reply at once. If a session is supplied (possibly shared by
+        # several bots), the caller owns it.
+        if session is None:
+            self._session = create_session(loop=self._loop)
+            self._own_session = True
+        else:
+            self._session = session
+            self._own_session = False
+
+        # Paces outgoing messages to stay within Telegram's flood limits.
+        # Should be a `telepot.async.ratelimit.Scheduler`.
+        self._scheduler = scheduler
+
+        # Repeats calls that fail for transient reasons. Should be a `telepot.async.retry.RetryPolicy`.
+        self._retry = retry
+
+        # Parses responses and serializes parameters. Picks the fastest JSON library installed
+        # unless told otherwise, e.g. `codec=telepot.codec.get('json')`.
+        self._codec = codec if codec is not None else telepot.codec.get()
+
+        # Remember the JSON form of keyboards sent over and over. Off by default, because
+        # a `reply_markup` object must not be modified once it has been sent.
+        if markup_cache_size:
+            self._markup_cache = telepot.cache.SerializationCache(self._dumps, markup_cache_size)
+        else:
+            self._markup_cache = None
+
+        # Send content uploaded before by the file_id Telegram gave it, instead of uploading
+        # it again. Should be a `telepot.cache.FileIdCache`.
+        self._file_id_cache = file_id_cache
+
+        # Keep results of read-only calls like `getFile` for a while. Should be a
+        # `telepot.cache.ResponseCache`. Tasks missing the same result at the same time wait
+        # for one call.
+        self._response_cache = response_cache
+        self._pending_calls = {}  # cache key => future of call in progress
+
+        # Keep downloaded files on disk, to be served again without going to Telegram.
+        # Should be a `telepot.async.cache.MediaCache`.
+        self._media_cache = media_cache
+
     @property
     def loop(self):
         return self._loop
 
+    @property
+    def session(self):
+        return self._session
+
+    @property
+    def scheduler(self):
+        return self._scheduler
+
+    @property
+    def retry(self):
+        return self._retry
+
+    @property
+    def codec(self):
+        return self._codec
+
+    @property
+    def file_id_cache(self):
+        return self._file_id_cache
+
+    @property
+    def response_cache(self):
+        return self._response_cache
+
+    @property
+    def media_cache(self):
+        return self._media_cache
+
+    @asyncio.coroutine
+    def close(self):
+        if self._own_session and not self._session.closed:
+            yield from self._session.close()
+
+    @asyncio.coroutine
+    def __aenter__(self):
+        return self
+
+    @asyncio.coroutine
+    def __aexit__(self, exc_type, exc_value, tb):
+        yield from self.close()
+
     def _fileurl(self, path):
-        return 'https://api.telegram.org/file/bot%s/%s' % (self._token, path)
+        return '%s/file/bot%s/%s' % (self._base_url, self._token, path)
 
     def _methodurl(self, method):
-        return 'https://api.telegram.org/bot%s/%s' % (self._token, method)
+        return '%s/bot%s/%s' % (self._base_url, self._token, method)
+
+    def _dumps(self, value):
+        return self._codec.dumps(value)
 
     def _rectify(self, params):
-        # remove None, then json-serialize if needed
-        return {key: value if type(value) not in [dict, list] else json.dumps(value, separators=(',',':')) for key,value in params.items() if value is not None}
+        # remove None, then json-serialize if needed, and make everything a string for form encoding
+        dumps = self._markup_cache.dumps if self._markup_cache else self._dumps
+        return {key: str(value) if type(value) not in (dict, list) else dumps(value) for key,value in params.items() if value is not None}
 
     @asyncio.coroutine
     def _parse(self, response):
+        body = yield from response.read()
         try:
-            data = yield from response.json()
+            data = self._codec.loads(body)
         except ValueError:
-            text = yield from response.text()
-            raise telepot.BadHTTPResponse(response.status, text)
+            raise telepot.BadHTTPResponse(response.status, body.decode('utf-8', 'replace'))
 
         if data['ok']:
             return data['result']
         else:
-            raise telepot.TelegramError(data['description'], data['error_code'])
+            raise telepot.TelegramError(data['description'], data['error_code'], data.get('parameters'))
 
+    # Make one attempt at calling `method`
     @asyncio.coroutine
-    def getMe(self):
-        r = yield from asyncio.wait_for(aiohttp.post(self._methodurl('getMe')), self._http_timeout)
+    def _post(self, method, params, files, timeout):
+        if self._scheduler and method in telepot.ratelimit.SEND_METHODS:
+            yield from self._scheduler.acquire(params['chat_id'])
+
+        # Parameters go in the request body, not the URL, so long texts do not hit URL length limits.
+        # If there are files, everything is streamed as multipart/form-data.
+        if files:
+            data = telepot.async.upload.MultipartPayload(self._rectify(params or {}), files, self._file_chunk_size, self._loop)
+        else:
+            data = self._rectify(params or {})
+
+        request = self._session.post(self._methodurl(method), data=data)
+
+        if timeout is None:
+            r = yield from request
+        else:
+            r = yield from asyncio.wait_for(request, timeout)
+
         return (yield from self._parse(r))
 
+    def _upload_timeout(self, files):
+        return self._http_timeout + sum([f.size for f in files.values()]) / self._upload_min_rate
+
+    @asyncio.coroutine
+    def _api_request(self, method, params=None, files=None, **kwargs):
+        cache = self._response_cache
+        if cache is None or not cache.caches(method):
+            return (yield from self._call(method, params, files, **kwargs))
+
+        key = cache.key(method, params)
+        while 1:
+            result = cache.get(key)
+            if result is not None:
+                return result
+
+            if key in self._pending_calls:
+                # If the call failed, fail with the same error. If it was cancelled, try again.
+                result, error = yield from asyncio.shield(self._pending_calls[key], loop=self._loop)
+                if error is not None:
+                    raise error
+                if result is not None:
+                    return result
+                continue
+
+            self._pending_calls[key] = done = asyncio.Future(loop=self._loop)
+            result = error = None
+            try:
+                result = yield from self._call(method, params, files, **kwargs)
+                cache.put(key, result)
+                return result
+            except CancelledError:
+                raise
+            except Exception as e:
+                error = e
+                raise
+            finally:
+                del self._pending_calls[key]
+                done.set_result((result, error))
+
+    @asyncio.coroutine
+    def _call(self, method, params=None, files=None, **kwargs):
+        if files:
+            # An `InputFile` reads from the same position on every attempt.
+            files = {k: f if isinstance(f, telepot.upload.InputFile) else telepot.upload.InputFile(f) for k,f in files.items()}
+            timeout = kwargs.pop('timeout', self._upload_timeout(files))
+        else:
+            timeout = kwargs.pop('timeout', self._http_timeout)
+
+        if self._retry is None:
+            return (yield from self._post(method, params, files, timeout))
+        else:
+            return (yield from self._retry.call(method, self._post, method, params, files, timeout))
+
+    @asyncio.coroutine
+    def getMe(self):
+        return (yield from self._api_request('getMe'))
+
     @asyncio.coroutine
     def sendMessage(self, chat_id, text, parse_mode=None, disable_web_page_preview=None, reply_to_message_id=None, reply_markup=None):
         p = {'chat_id': chat_id, 'text': text, 'parse_mode': parse_mode, 'disable_web_page_preview': disable_web_page_preview, 'reply_to_message_id': reply_to_message_id, 'reply_markup': reply_markup}
-        r = yield from asyncio.wait_for(aiohttp.post(self._methodurl('sendMessage'), params=self._rectify(p)), self._http_timeout)
-        return (yield from self._parse(r))
+        return (yield from self._api_request('sendMessage', p))
 
     @asyncio.coroutine
     def forwardMessage(self, chat_id, from_chat_id, message_id):
         p = {'chat_id': chat_id, 'from_chat_id': from_chat_id, 'message_id': message_id}
-        r = yield from asyncio.wait_for(aiohttp.post(self._methodurl('forwardMessage'), params=self._rectify(p)), self._http_timeout)
-        return (yield from self._parse(r))
+        return (yield from self._api_request('forwardMessage', p))
 
     @asyncio.coroutine
     def _sendFile(self, inputfile, filetype, params):
@@ -70,18 +260,45 @@ class Bot(object):
                   'video':    'sendVideo',
                   'voice':    'sendVoice',}[filetype]
 
-        if isinstance(inputfile, io.IOBase):
-            files = {filetype: inputfile}
-            r = yield from aiohttp.post(self._methodurl(method), params=self._rectify(params), data=files)
+        if telepot.upload.is_content(inputfile):
+            if self._file_id_cache is None:
+                files = {filetype: inputfile}
 
-            # `_http_timeout` is not used here because, for some reason, the larger the file, 
-            # the longer it takes for the server to respond (after upload is finished). It is hard to say
-            # what value `_http_timeout` should be. In the future, maybe I should let user specify.
+                # The larger the file, the longer it takes for the server to respond (after upload
+                # is finished), so the timeout grows with file size. See `_upload_timeout()`.
+                return (yield from self._api_request(method, params, files))
+            else:
+                return (yield from self._sendCachedFile(method, inputfile, filetype, params))
         else:
             params[filetype] = inputfile
-            r = yield from asyncio.wait_for(aiohttp.post(self._methodurl(method), params=self._rectify(params)), self._http_timeout)
+            return (yield from self._api_request(method, params))
 
-        return (yield from self._parse(r))
+    @asyncio.coroutine
+    def _sendCachedFile(self, method, inputfile, filetype, params):
+        f = inputfile if isinstance(inputfile, telepot.upload.InputFile) else telepot.upload.InputFile(inputfile)
+
+        # Hashing reads the whole file, so keep it off the event loop.
+        if f.isfile():
+            key = yield from self._loop.run_in_executor(None, telepot.upload.cache_key, f, filetype)
+        else:
+            key = telepot.upload.cache_key(f, filetype)
+
+        file_id = self._file_id_cache.get(key)
+        if file_id is not None:
+            try:
+                return (yield from self._api_request(method, dict(params, **{filetype: file_id})))
+            except telepot.TelegramError as e:
+                if not telepot.upload.file_id_refused(e):
+                    raise
+                self._file_id_cache.pop(key)  # file_id expired, upload again
+
+        msg = yield from self._api_request(method, params, {filetype: f})
+
+        file_id = telepot.upload.sent_file_id(msg, filetype)
+        if file_id is not None:
+            self._file_id_cache.put(key, file_id)
+
+        return msg
 
     @asyncio.coroutine
     def sendPhoto(self, chat_id, photo, caption=None, reply_to_message_id=None, reply_markup=None):
@@ -110,32 +327,27 @@ class Bot(object):
     @asyncio.coroutine
     def sendLocation(self, chat_id, latitude, longitude, reply_to_message_id=None, reply_markup=None):
         p = {'chat_id': chat_id, 'latitude': latitude, 'longitude': longitude, 'reply_to_message_id': reply_to_message_id, 'reply_markup': reply_markup}
-        r = yield from asyncio.wait_for(aiohttp.post(self._methodurl('sendLocation'), params=self._rectify(p)), self._http_timeout)
-        return (yield from self._parse(r))
+        return (yield from self._api_request('sendLocation', p))
 
     @asyncio.coroutine
     def sendChatAction(self, chat_id, action):
         p = {'chat_id': chat_id, 'action': action}
-        r = yield from asyncio.wait_for(aiohttp.post(self._methodurl('sendChatAction'), params=self._rectify(p)), self._http_timeout)
-        return (yield from self._parse(r))
+        return (yield from self._api_request('sendChatAction', p))
 
     @asyncio.coroutine
     def getUserProfilePhotos(self, user_id, offset=None, limit=None):
         p = {'user_id': user_id, 'offset': offset, 'limit': limit}
-        r = yield from asyncio.wait_for(aiohttp.post(self._methodurl('getUserProfilePhotos'), params=self._rectify(p)), self._http_timeout)
-        return (yield from self._parse(r))
+        return (yield from self._api_request('getUserProfilePhotos', p))
 
     @asyncio.coroutine
     def getFile(self, file_id):
         p = {'file_id': file_id}
-        r = yield from asyncio.wait_for(aiohttp.post(self._methodurl('getFile'), params=self._rectify(p)), self._http_timeout)
-        return (yield from self._parse(r))
+        return (yield from self._api_request('getFile', p))
 
     @asyncio.coroutine
     def getUpdates(self, offset=None, limit=None, timeout=None):
         p = {'offset': offset, 'limit': limit, 'timeout': timeout}
-        r = yield from asyncio.wait_for(aiohttp.post(self._methodurl('getUpdates'), params=self._rectify(p)), self._http_timeout+(0 if timeout is None else timeout))
-        return (yield from self._parse(r))
+        return (yield from self._api_request('getUpdates', p, timeout=self._http_timeout+(0 if timeout is None else timeout)))
 
     @asyncio.coroutine
     def setWebhook(self, url=None, certificate=None):
@@ -143,86 +355,180 @@ class Bot(object):
 
         if certificate:
             files = {'certificate': certificate}
-            r = yield from asyncio.wait_for(aiohttp.post(self._methodurl('setWebhook'), params=self._rectify(p), files=files), self._http_timeout)
+            return (yield from self._api_request('setWebhook', p, files))
         else:
-            r = yield from asyncio.wait_for(aiohttp.post(self._methodurl('setWebhook'), params=self._rectify(p)), self._http_timeout)
+            return (yield from self._api_request('setWebhook', p))
 
-        return (yield from self._parse(r))
+    @asyncio.coroutine
+    def downloadFile(self, file_id, dest, parallel=1):
+        if self._media_cache is None:
+            yield from self._downloadFile(file_id, dest, parallel)
+        else:
+            f = yield from self._media_cache.fetch(file_id, lambda path: self._downloadFile(file_id, path, parallel), self._loop)
+            try:
+                yield from self._loop.run_in_executor(None, telepot.download.copy, f, dest, self._file_chunk_size)
+            finally:
+                f.close()
 
     @asyncio.coroutine
-    def downloadFile(self, file_id, dest):
+    def _downloadFile(self, file_id, dest, parallel):
         f = yield from self.getFile(file_id)
 
         # `file_path` is optional in File object
         if 'file_path' not in f:
             raise telepot.TelegramError('No file_path returned', None)
 
-        try:
-            r = yield from asyncio.wait_for(aiohttp.get(self._fileurl(f['file_path'])), self._http_timeout)
+        # `dest` may be a path, a file object, or a writable buffer such as a bytearray or mmap.
+        # A broken connection is resumed where it left off.
+        yield from telepot.async.download.download(self._session, self._fileurl(f['file_path']), dest, f.get('file_size'),
+                                                   self._file_chunk_size, self._http_timeout, parallel, loop=self._loop)
 
-            d = dest if isinstance(dest, io.IOBase) else open(dest, 'wb')
+    @asyncio.coroutine
+    def streamFile(self, file_id, chunk_size=None):
+        f = yield from self.getFile(file_id)
 
-            while 1:
-                chunk = yield from r.content.read(self._file_chunk_size)
-                if not chunk:
-                    break
-                d.write(chunk)
-                d.flush()
-        finally:
-            if not isinstance(dest, io.IOBase) and 'd' in locals():
-                d.close()
+        # `file_path` is optional in File object
+        if 'file_path' not in f:
+            raise telepot.TelegramError('No file_path returned', None)
 
-            if 'r' in locals():
-                r.close()
+        return telepot.async.download.ChunkStream(self._session, self._fileurl(f['file_path']), f.get('file_size'),
+                                                  chunk_size or self._file_chunk_size, self._http_timeout, self._loop)
+
+    def broadcast(self, chat_ids, text, parse_mode=None, disable_web_page_preview=None, reply_markup=None, concurrency=100, checkpoint=None):
+        p = {'text': text, 'parse_mode': parse_mode, 'disable_web_page_preview': disable_web_page_preview, 'reply_markup': reply_markup}
+
+        # Serialize once, not once per recipient.
+        return telepot.async.broadcast.Broadcast(self, chat_ids, self._rectify(p), concurrency, checkpoint)
 
     @asyncio.coroutine
-    def messageLoop(self, handler=None):
-        if handler is None:
-            handler = self.handle
+    def _handleUpdates(self, updates, handler, concurrency, lanes, maxsize, tracker):
+        # Mark an update handled once its handler finishes
+        def done(update_id):
+            return lambda f: tracker.done(update_id)
 
-        offset = None  # running offset
-        while 1:
+        if lanes:
+            dispatcher = telepot.async.executor.ChatDispatcher(handler, lanes, -(-maxsize // lanes), self._loop)
             try:
-                updates = yield from self.getUpdates(offset=offset, timeout=20)
+                while 1:
+                    u = yield from updates.get()
+                    f = yield from dispatcher.dispatch(u['message'])
+                    f.add_done_callback(done(u['update_id']))
+            finally:
+                yield from dispatcher.shutdown(wait=False)
 
-                if len(updates) > 0:
-                    # Update offset to max(update_id) + 1
-                    offset = max([u['update_id'] for u in updates]) + 1
+        semaphore = asyncio.Semaphore(concurrency, loop=self._loop) if concurrency else None
 
-                    for u in updates:
-                        if asyncio.iscoroutinefunction(handler):
-                            self._loop.create_task(handler(u['message']))
-                        else:
-                            handler(u['message'])
+        while 1:
+            u = yield from updates.get()
 
-            except CancelledError:
-                raise  # Stop if cancelled
-            except:
-                traceback.print_exc()  # Keep running on other errors
-                yield from asyncio.sleep(0.1)
+            if asyncio.iscoroutinefunction(handler):
+                if semaphore:
+                    yield from semaphore.acquire()
+
+                t = self._loop.create_task(handler(u['message']))
+                t.add_done_callback(done(u['update_id']))
+
+                if semaphore:
+                    t.add_done_callback(lambda t: semaphore.release())
             else:
-                yield from asyncio.sleep(0.1)
+                try:
+                    handler(u['message'])
+                except:
+                    traceback.print_exc()
+                finally:
+                    tracker.done(u['update_id'])
+
+    @asyncio.coroutine
+    def messageLoop(self, handler=None, relax=0.1, timeout=20, maxsize=1000, concurrency=None, lanes=None, offset_store=None, recorder=None):
+        if handler is None:
+            handler = self.handle
+
+        # Drops updates seen before, and keeps the offset and updates not yet handled in
+        # `offset_store`, if given.
+        tracker = telepot.offset.OffsetTracker(offset_store)
+
+        # Fetching and handling are separate tasks, joined by a queue. Fetching never waits
+        # for handlers, unless the queue is full.
+        updates = asyncio.Queue(maxsize, loop=self._loop)
+        consumer = self._loop.create_task(self._handleUpdates(updates, handler, concurrency, lanes, maxsize, tracker))
+
+        backlog = False
+        try:
+            # Updates fetched before a restart, but not handled, go first.
+            for u in tracker.recover():
+                yield from updates.put(u)
+
+            while 1:
+                try:
+                    # Ask for no more updates than the queue has room for, but not so few that
+                    # polling goes on a few updates at a time while handlers catch up. If the last
+                    # batch was full, more updates are probably waiting. Fetch them without long-polling.
+                    limit = max(25, min(100, maxsize - updates.qsize())) if maxsize > 0 else 100
+                    result = yield from self.getUpdates(offset=tracker.offset, limit=limit, timeout=0 if backlog else timeout)
+
+                    # Drop updates seen before, which also moves the offset past the rest.
+                    fresh = tracker.accept(result)
+
+                    if recorder:
+                        for u in fresh:
+                            recorder.write(u)
+
+                    for u in fresh:
+                        yield from updates.put(u)
+
+                    backlog = len(fresh) > 0 and len(result) >= limit
+                except CancelledError:
+                    raise  # Stop if cancelled
+                except:
+                    traceback.print_exc()  # Keep running on other errors
+                    backlog = False
+                    yield from asyncio.sleep(relax)
+                else:
+                    # Relax only when there is nothing to do.
+                    if not fresh:
+                        yield from asyncio.sleep(relax)
+        finally:
+            consumer.cancel()
+            tracker.flush()
+
+    # Receive updates through a webhook instead of polling. Runs until cancelled.
+    @asyncio.coroutine
+    def webhookLoop(self, path, port=8443, host='', certfile=None, keyfile=None, handler=None, concurrency=100, lanes=None):
+        if handler is None:
+            handler = self.handle
+
+        server = telepot.async.webhook.WebhookServer(path, handler, host, port, certfile, keyfile, self._codec, concurrency, lanes, self._loop)
+        yield from server.start()
+        try:
+            yield from asyncio.Future(loop=self._loop)
+        finally:
+            yield from server.stop()
 
 
 class SpeakerBot(Bot):
-    def __init__(self, token, loop=None):
-        super(SpeakerBot, self).__init__(token, loop)
+    def __init__(self, token, loop=None, listener_queue=None, **kwargs):
+        super(SpeakerBot, self).__init__(token, loop, **kwargs)
         self._mic = telepot.async.helper.Microphone()
 
+        # Creates each listener's message queue, e.g.
+        # `lambda: telepot.async.helper.ListenerQueue(100, telepot.helper.DROP_OLDEST, loop=loop)`.
+        # Unbounded queues by default.
+        self._listener_queue = listener_queue
+
     @property
     def mic(self):
         return self._mic
 
     def create_listener(self):
-        q = asyncio.Queue()
+        q = self._listener_queue() if self._listener_queue else asyncio.Queue()
         self._mic.add(q)
         ln = telepot.async.helper.Listener(self._mic, q)
         return ln
 
 
 class DelegatorBot(SpeakerBot):
-    def __init__(self, token, delegation_patterns, loop=None):
-        super(DelegatorBot, self).__init__(token, loop)
+    def __init__(self, token, delegation_patterns, loop=None, **kwargs):
+        super(DelegatorBot, self).__init__(token, loop, **kwargs)
         self._delegate_records = [p+({},) for p in delegation_patterns]
 
     def handle(self, msg):
@@ -0,0 +1,108 @@
+import asyncio
+from concurrent.futures._base import CancelledError
+from telepot.broadcast import Checkpoint, _settled
+
+
+# Sends the same `payload` to every chat in `chat_ids`, with at most `concurrency` requests
+# in flight. Results are read one at a time, as soon as each recipient is served:
+#
+#   b = bot.broadcast(chat_ids, 'Hello')
+#   while 1:
+#       r = yield from b.get()
+#       if r is None:
+#           break
+#       chat_id, msg, exception = r
+#
+# or, in Python 3.5, `async for chat_id, msg, exception in b:`
+class Broadcast(object):
+    def __init__(self, bot, chat_ids, payload, concurrency=100, checkpoint=None):
+        self._bot = bot
+        self._loop = bot.loop
+        self._results = asyncio.Queue(concurrency * 2, loop=self._loop)
+        self._finished = False
+        self._task = self._loop.create_task(self._run(chat_ids, payload, concurrency, checkpoint))
+
+    @asyncio.coroutine
+    def _send(self, chat_id, payload, checkpoint, semaphore):
+        try:
+            try:
+                msg, e = (yield from self._bot._api_request('sendMessage', dict(payload, chat_id=chat_id))), None
+            except CancelledError:
+                raise
+            except Exception as ex:
+                msg, e = None, ex
+
+            if checkpoint and _settled(e):
+                checkpoint.mark(chat_id)
+
+            # Block if the consumer falls behind.
+            yield from self._results.put((chat_id, msg, e))
+        finally:
+            semaphore.release()
+
+    @asyncio.coroutine
+    def _run(self, chat_ids, payload, concurrency, checkpoint):
+        done = checkpoint.load() if checkpoint else set()
+        semaphore = asyncio.Semaphore(concurrency, loop=self._loop)
+        tasks = set()
+
+        try:
+            for chat_id in chat_ids:
+                if str(chat_id) in done:
+                    continue
+
+                yield from semaphore.acquire()
+
+                t = self._loop.create_task(self._send(chat_id, payload, checkpoint, semaphore))
+                tasks.add(t)
+                t.add_done_callback(tasks.discard)
+
+            if tasks:
+                yield from asyncio.wait(tasks, loop=self._loop)
+        finally:
+            for t in tasks:
+                t.cancel()
+
+            if checkpoint:
+                checkpoint.close()
+
+    # Returns the next (chat_id, message, exception), or None when all recipients are served,
+    # or the broadcast is cancelled. Raises the exception that stopped it, e.g. one raised by
+    # iterating `chat_ids`.
+    @asyncio.coroutine
+    def get(self):
+        if self._finished:
+            return None
+
+        # Wait for a result, or for the broadcast to end, however it ends.
+        if self._results.empty() and not self._task.done():
+            getter = self._loop.create_task(self._results.get())
+            try:
+                yield from asyncio.wait([getter, self._task], loop=self._loop, return_when=asyncio.FIRST_COMPLETED)
+            finally:
+                if not getter.done():
+                    getter.cancel()
+
+            if getter.done() and not getter.cancelled():
+                return getter.result()
+
+        if not self._results.empty():
+            return self._results.get_nowait()
+
+        self._finished = True
+        if not self._task.cancelled() and self._task.exception() is not None:
+            raise self._task.exception()
+        return None
+
+    def cancel(self):
+        self._task.cancel()
+
+    def __aiter__(self):
+        return self
+
+    @asyncio.coroutine
+    def __anext__(self):
+        r = yield from self.get()
+        if r is None:
+            raise StopAsyncIteration
+        return r
@@ -0,0 +1,46 @@
+import asyncio
+from concurrent.futures._base import CancelledError
+import telepot.cache
+
+
+class MediaCache(telepot.cache.MediaCache):
+    def __init__(self, directory, maxsize=1073741824):
+        super(MediaCache, self).__init__(directory, maxsize)
+        self._waiting = {}  # name => future of download in progress
+
+    # Returns the cached file of `file_id` opened for reading. If it is not cached, it is
+    # downloaded by the coroutine `download(path)`, which should save the file at `path`.
+    # Tasks asking for the same file_id at the same time wait for one download.
+    @asyncio.coroutine
+    def fetch(self, file_id, download, loop=None):
+        loop = loop if loop is not None else asyncio.get_event_loop()
+        name = self._name(file_id)
+
+        while 1:
+            f = self.open(file_id)
+            if f is not None:
+                return f
+
+            if name in self._waiting:
+                # If the download failed, fail with the same error. If it was cancelled, try again.
+                error = yield from asyncio.shield(self._waiting[name], loop=loop)
+                if error is not None:
+                    raise error
+                continue
+
+            self._waiting[name] = done = asyncio.Future(loop=loop)
+            error = None
+            tmp = self._tempfile(name)
+            try:
+                yield from download(tmp)
+                yield from loop.run_in_executor(None, self._add, name, tmp)
+            except CancelledError:
+                telepot.cache._remove(tmp)
+                raise
+            except Exception as e:
+                error = e
+                telepot.cache._remove(tmp)
+                raise
+            finally:
+                del self._waiting[name]
+                done.set_result(error)
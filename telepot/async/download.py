@@ -0,0 +1,208 @@
+import asyncio
+import aiohttp
+import telepot
+from telepot.download import IncompleteDownload, open_sink, segments, range_header
+
+_network_errors = (aiohttp.ClientError, asyncio.TimeoutError)
+
+
+# Copy the response body into `sink`, from `pos` up to `end`. Writes to a file are done in the
+# default executor, so the event loop does not block on disk. If the server ignored the Range
+# header (status 200), the first `pos` bytes are skipped.
+# Returns the new position, and the network error that stopped the copy, if any.
+@asyncio.coroutine
+def _copy(r, sink, pos, end, chunk_size, loop):
+    skip = pos if r.status == 200 else 0
+
+    while end is None or pos < end:
+        n = chunk_size if end is None else min(chunk_size, end - pos)
+
+        try:
+            data = yield from r.content.read(min(n, skip) if skip else n)
+        except _network_errors as e:
+            return pos, e
+
+        if not data:
+            return pos, None if end is None else IncompleteDownload(pos, end)
+
+        if skip:
+            skip -= len(data)
+            continue
+
+        if sink.view is not None:
+            sink.write(pos, data)
+        else:
+            yield from loop.run_in_executor(None, sink.write, pos, data)
+        pos += len(data)
+
+    return pos, None
+
+
+# Download the range from `start` to `end` (None meaning the end of file) into `sink`,
+# resuming with a Range request if the connection breaks. Gives up after `retries`
+# attempts in a row that make no progress.
+@asyncio.coroutine
+def fetch(session, url, sink, start, end, chunk_size, timeout, loop, retries=3):
+    pos, failures = start, 0
+
+    while 1:
+        # Compressed bodies cannot be resumed, so ask for the file as it is.
+        headers = {'Accept-Encoding': 'identity'}
+        if pos > 0 or end is not None:
+            headers['Range'] = range_header(pos, end)
+
+        try:
+            r = yield from asyncio.wait_for(session.get(url, headers=headers), timeout, loop=loop)
+        except _network_errors as e:
+            error = e
+        else:
+            try:
+                if r.status not in (200, 206):
+                    text = yield from r.text()
+                    raise telepot.BadHTTPResponse(r.status, text)
+
+                p, error = yield from _copy(r, sink, pos, end, chunk_size, loop)
+            finally:
+                r.close()
+
+            if p > pos:
+                pos, failures = p, 0
+
+        if error is None:
+            return
+
+        failures += 1
+        if failures > retries:
+            raise error
+
+
+# Download `url` into `dest`, which may be a path, a file object or a writable buffer.
+# If `size` is known and `parallel` is more than 1, segments of the file are fetched
+# at the same time.
+@asyncio.coroutine
+def download(session, url, dest, size, chunk_size, timeout, parallel=1, retries=3, loop=None):
+    loop = loop if loop is not None else asyncio.get_event_loop()
+    sink, close = open_sink(dest, size)
+    try:
+        ranges = segments(size, parallel if sink.seekable else 1)
+        tasks = [loop.create_task(fetch(session, url, sink, start, end, chunk_size, timeout, loop, retries))
+                     for start, end in ranges]
+        try:
+            yield from asyncio.wait(tasks, loop=loop, return_when=asyncio.FIRST_EXCEPTION)
+        finally:
+            # Nothing may write to the sink once it is closed.
+            for t in tasks:
+                t.cancel()
+            yield from asyncio.wait(tasks, loop=loop)
+
+        for t in tasks:
+            t.result()
+    finally:
+        close()
+
+
+# Reads the file at `url` chunk by chunk. Nothing is read from the connection until the
+# consumer asks for the next chunk, so a slow consumer holds back the download instead of
+# letting data pile up in memory. A broken connection is resumed where it left off.
+#
+#   stream = yield from bot.streamFile(file_id)
+#   while 1:
+#       chunk = yield from stream.read()
+#       if not chunk:
+#           break
+#
+# or, in Python 3.5, `async for chunk in stream:`
+class ChunkStream(object):
+    def __init__(self, session, url, size, chunk_size, timeout, loop, retries=3):
+        self._session = session
+        self._url = url
+        self._size = size
+        self._chunk_size = chunk_size
+        self._timeout = timeout
+        self._loop = loop
+        self._retries = retries
+
+        self._response = None
+        self._skip = 0
+        self._pos = 0
+        self._failures = 0
+        self._finished = False
+
+    @property
+    def position(self):
+        return self._pos
+
+    @asyncio.coroutine
+    def _open(self):
+        headers = {'Accept-Encoding': 'identity'}
+        if self._pos > 0:
+            headers['Range'] = range_header(self._pos, None)
+
+        r = yield from asyncio.wait_for(self._session.get(self._url, headers=headers), self._timeout, loop=self._loop)
+
+        if r.status not in (200, 206):
+            text = yield from r.text()
+            r.close()
+            raise telepot.BadHTTPResponse(r.status, text)
+
+        # Server ignored the Range header
+        self._skip = self._pos if r.status == 200 else 0
+        self._response = r
+
+    def _failed(self, e):
+        self.close()
+        self._failures += 1
+        if self._failures > self._retries:
+            self._finished = True
+            raise e
+
+    # Returns the next chunk, or b'' when the whole file has been read.
+    @asyncio.coroutine
+    def read(self):
+        while not self._finished and (self._size is None or self._pos < self._size):
+            if self._response is None:
+                try:
+                    yield from self._open()
+                except _network_errors as e:
+                    self._failed(e)
+                    continue
+
+            try:
+                data = yield from self._response.content.read(self._chunk_size)
+            except _network_errors as e:
+                self._failed(e)
+                continue
+
+            if not data:
+                if self._size is None:
+                    break
+                self._failed(IncompleteDownload(self._pos, self._size))
+                continue
+
+            if self._skip:
+                data, self._skip = data[self._skip:], max(0, self._skip - len(data))
+                if not data:
+                    continue
+
+            self._pos += len(data)
+            self._failures = 0
+            return data
+
+        self._finished = True
+        self.close()
+        return b''
+
+    def close(self):
+        if self._response is not None:
+            self._response.close()
+            self._response = None
+
+    def __aiter__(self):
+        return self
+
+    @asyncio.coroutine
+    def __anext__(self):
+        data = yield from self.read()
+        if not data:
+            raise StopAsyncIteration
+        return data
@@ -0,0 +1,126 @@
+import asyncio
+import itertools
+import traceback
+from concurrent.futures._base import CancelledError
+import telepot.executor
+
+
+# Runs functions and coroutine functions on a fixed number of tasks, called lanes. Work
+# submitted with the same key always goes to the same lane, so it is carried out in the
+# order submitted. Work with different keys proceeds concurrently, as long as the keys
+# fall on different lanes.
+class OrderedExecutor(object):
+    def __init__(self, lanes=8, maxsize=0, loop=None):
+        self._loop = loop if loop is not None else asyncio.get_event_loop()
+        self._queues = [asyncio.Queue(maxsize, loop=self._loop) for i in range(lanes)]
+        self._counter = itertools.count()
+        self._shutdown = False
+        self._stopping = False  # whether lanes are being cancelled
+        self._tasks = [self._loop.create_task(self._work(q)) for q in self._queues]
+
+    @property
+    def lanes(self):
+        return len(self._queues)
+
+    @asyncio.coroutine
+    def _work(self, q):
+        while 1:
+            item = yield from q.get()
+            if item is None:
+                return
+
+            f, fn, args, kwargs = item
+            if f.cancelled():
+                continue
+
+            try:
+                r = fn(*args, **kwargs)
+                if asyncio.iscoroutine(r):
+                    r = yield from r
+            except CancelledError:
+                f.cancel()
+
+                # Stop only if the lane itself is cancelled, not if `fn` was, e.g. by a timeout.
+                # The lane must keep going, or its chats would wait forever.
+                if self._stopping:
+                    raise
+            except Exception as e:
+                # The caller may have cancelled the future, e.g. with `asyncio.wait_for()`.
+                if not f.done():
+                    f.set_exception(e)
+            else:
+                if not f.done():
+                    f.set_result(r)
+
+    # Number of items waiting in all lanes
+    def qsize(self):
+        return sum([q.qsize() for q in self._queues])
+
+    def lane_of(self, key):
+        if key is None:
+            return next(self._counter) % len(self._queues)
+        else:
+            return hash(key) % len(self._queues)
+
+    # Returns an `asyncio.Future`. A `key` of None means no ordering is required.
+    # Waits if the lane is full.
+    @asyncio.coroutine
+    def submit(self, key, fn, *args, **kwargs):
+        if self._shutdown:
+            raise RuntimeError('Cannot submit after shutdown')
+
+        f = asyncio.Future(loop=self._loop)
+        yield from self._queues[self.lane_of(key)].put((f, fn, args, kwargs))
+        return f
+
+    # Let the lanes finish what is queued, then stop. If `wait` is False, stop right away.
+    @asyncio.coroutine
+    def shutdown(self, wait=True):
+        self._shutdown = True
+
+        if wait:
+            for q in self._queues:
+                yield from q.put(None)
+            yield from asyncio.wait(self._tasks, loop=self._loop)
+        else:
+            self._stopping = True
+            for t in self._tasks:
+                t.cancel()
+
+
+# Passes messages to `handler` on `lanes` tasks. Messages of the same chat always go to the
+# same lane, so a chat's messages are handled one after another, in order, even by a
+# coroutine handler. Different chats are handled concurrently.
+class ChatDispatcher(object):
+    def __init__(self, handler, lanes=8, maxsize=0, loop=None):
+        self._handler = handler
+        self._executor = OrderedExecutor(lanes, maxsize, loop)
+
+    @property
+    def executor(self):
+        return self._executor
+
+    @asyncio.coroutine
+    def _handle(self, msg):
+        try:
+            r = self._handler(msg)
+            if asyncio.iscoroutine(r):
+                yield from r
+        except CancelledError:
+            raise
+        except:
+            traceback.print_exc()
+
+    # Returns an `asyncio.Future`, done when the message has been handled.
+    # Waits if the chat's lane is full.
+    @asyncio.coroutine
+    def dispatch(self, msg):
+        return (yield from self._executor.submit(telepot.executor.chat_key(msg), self._handle, msg))
+
+    def qsize(self):
+        return self._executor.qsize()
+
+    @asyncio.coroutine
+    def shutdown(self, wait=True):
+        yield from self._executor.shutdown(wait)
+
@@ -3,6 +3,28 @@ import traceback
 import time
 import telepot.helper
 import telepot.filtering
+from telepot.helper import BLOCK, DROP_OLDEST, DROP_NEWEST, SPILL
+
+
+# Same as `telepot.helper.ListenerQueue`, except that BLOCK is not possible, because
+# `Microphone.send()` cannot wait.
+class ListenerQueue(asyncio.Queue):
+    def __init__(self, maxsize=0, overflow=DROP_OLDEST, spill_dir=None, loop=None):
+        if overflow not in (DROP_OLDEST, DROP_NEWEST, SPILL):
+            raise ValueError('Unsupported overflow policy: %s' % overflow)
+
+        self.overflow = overflow
+        self._limit = maxsize
+        self._spill_dir = spill_dir
+
+        # The queue takes every message. The buffer decides what to keep.
+        super(ListenerQueue, self).__init__(0, loop=loop)
+
+    def _init(self, maxsize):
+        self._queue = telepot.helper._Buffer(self._limit, self.overflow, self._spill_dir)
+
+    def stats(self):
+        return self._queue.stats()
 
 
 class Microphone(object):
@@ -0,0 +1,169 @@
+import asyncio
+import collections
+import traceback
+from concurrent.futures._base import CancelledError
+import telepot.async
+import telepot.offset
+
+
+class _Entry(object):
+    def __init__(self, bot, handler, tracker, maxsize, loop):
+        self.bot = bot
+        self.handler = handler
+        self.tracker = tracker
+        self.queue = asyncio.Queue(maxsize, loop=loop)
+        self.scheduled = False  # whether it is in the ready queue
+        self.task = None
+
+
+# Polls many bots on one event loop, and hands their updates to `concurrency` worker tasks
+# shared by all bots. Each bot long-polls on a task of its own, and keeps at most `maxsize`
+# updates waiting. Workers take turns among bots with updates waiting, one update at a time,
+# so a busy bot cannot hold up quiet ones. A busy bot whose updates pile up stops polling
+# until workers catch up.
+#
+# Bots should be created with `session=mux.session`, to share its connection pool. It has no
+# limit on connections, because every bot keeps one open to long-poll.
+class Multiplexer(object):
+    def __init__(self, session=None, concurrency=100, maxsize=100, relax=0.1, timeout=20, loop=None):
+        self._loop = loop if loop is not None else asyncio.get_event_loop()
+
+        if session is None:
+            self.session = telepot.async.create_session(limit=0, loop=self._loop)
+            self._own_session = True
+        else:
+            self.session = session
+            self._own_session = False
+
+        self._concurrency = concurrency
+        self._maxsize = maxsize
+        self._relax = relax
+        self._timeout = timeout
+
+        self._entries = collections.OrderedDict()
+        self._ready = collections.deque()  # bots with updates waiting, in turn
+        self._pending = asyncio.Semaphore(0, loop=self._loop)  # counts updates waiting
+        self._workers = None
+        self._stopping = False  # whether workers are being cancelled
+
+    @property
+    def bots(self):
+        return list(self._entries)
+
+    # Start polling `bot`, passing its messages to `handler`, `bot.handle` by default.
+    # A `DelegatorBot` thus routes its own messages. `offset_store` works as in `messageLoop()`.
+    def add(self, bot, handler=None, offset_store=None):
+        if bot in self._entries:
+            raise ValueError('Bot already added')
+
+        e = _Entry(bot, handler if handler is not None else bot.handle, telepot.offset.OffsetTracker(offset_store), self._maxsize, self._loop)
+        self._entries[bot] = e
+
+        if self._workers is not None:
+            e.task = self._loop.create_task(self._poll(e))
+
+    # Stop polling `bot`. Updates already fetched are still handled.
+    def remove(self, bot):
+        e = self._entries.pop(bot)
+        if e.task:
+            e.task.cancel()
+
+    # Number of updates waiting, per bot
+    def qsize(self):
+        return dict([(bot, e.queue.qsize()) for bot, e in self._entries.items()])
+
+    # Queue an update, and line the bot up for workers
+    @asyncio.coroutine
+    def _enqueue(self, e, u):
+        yield from e.queue.put(u)
+
+        if not e.scheduled:
+            e.scheduled = True
+            self._ready.append(e)
+
+        self._pending.release()
+
+    @asyncio.coroutine
+    def _poll(self, e):
+        # Updates fetched before a restart, but not handled, go first.
+        for u in e.tracker.recover():
+            yield from self._enqueue(e, u)
+
+        backlog = False
+        while 1:
+            try:
+                # As in `messageLoop()`
+                limit = max(25, min(100, self._maxsize - e.queue.qsize())) if self._maxsize > 0 else 100
+                result = yield from e.bot.getUpdates(offset=e.tracker.offset, limit=limit, timeout=0 if backlog else self._timeout)
+
+                fresh = e.tracker.accept(result)
+
+                for u in fresh:
+                    yield from self._enqueue(e, u)
+
+                backlog = len(fresh) > 0 and len(result) >= limit
+            except CancelledError:
+                raise  # Stop if cancelled
+            except:
+                traceback.print_exc()  # Keep running on other errors
+                backlog = False
+                yield from asyncio.sleep(self._relax, loop=self._loop)
+            else:
+                # Relax only when there is nothing to do.
+                if not fresh:
+                    yield from asyncio.sleep(self._relax, loop=self._loop)
+
+    @asyncio.coroutine
+    def _work(self):
+        while 1:
+            yield from self._pending.acquire()
+
+            # Take one update from the bot whose turn it is. If it has more, it goes to
+            # the back of the line.
+            e = self._ready.popleft()
+            u = e.queue.get_nowait()
+            if e.queue.empty():
+                e.scheduled = False
+            else:
+                self._ready.append(e)
+
+            try:
+                r = e.handler(u['message'])
+                if asyncio.iscoroutine(r):
+                    yield from r
+            except CancelledError:
+                # Not handled, so it stays in the offset store, and is handled after a restart
+                if self._stopping:
+                    raise
+
+                # The handler itself was cancelled, e.g. by a timeout. Keep the worker going.
+                traceback.print_exc()
+            except:
+                traceback.print_exc()
+
+            e.tracker.done(u['update_id'])
+
+    # Poll all bots, and keep polling bots added later. Runs until cancelled.
+    @asyncio.coroutine
+    def run(self):
+        self._stopping = False
+        self._workers = [self._loop.create_task(self._work()) for i in range(self._concurrency)]
+        for e in self._entries.values():
+            e.task = self._loop.create_task(self._poll(e))
+
+        try:
+            yield from asyncio.Future(loop=self._loop)
+        finally:
+            self._stopping = True
+            tasks = self._workers + [e.task for e in self._entries.values()]
+            for t in tasks:
+                t.cancel()
+            yield from asyncio.wait(tasks, loop=self._loop)
+
+            for e in self._entries.values():
+                e.task = None
+                e.tracker.flush()
+            self._workers = None
+
+            if self._own_session and not self.session.closed:
+                yield from self.session.close()
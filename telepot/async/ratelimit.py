@@ -0,0 +1,13 @@
+import asyncio
+import telepot.ratelimit
+
+
+class Scheduler(telepot.ratelimit.Scheduler):
+    @asyncio.coroutine
+    def acquire(self, chat_id):
+        delay = self.reserve(chat_id)
+        if delay > 0:
+            try:
+                yield from asyncio.sleep(delay)
+            finally:
+                self._release()
@@ -0,0 +1,64 @@
+import time
+import asyncio
+import traceback
+from concurrent.futures._base import CancelledError
+from telepot.record import Recorder, read, report
+
+
+# Same as `telepot.record.replay()`, except that a coroutine `handler` is run as a task,
+# at most `concurrency` at once, so a slow handler does not hold up the replay. Latency is
+# measured until the task finishes.
+@asyncio.coroutine
+def replay(path, handler, speed=1.0, concurrency=100, codec=None, loop=None):
+    loop = loop if loop is not None else asyncio.get_event_loop()
+    semaphore = asyncio.Semaphore(concurrency, loop=loop)
+    latencies, errors = [], [0]
+    tasks = set()
+
+    @asyncio.coroutine
+    def run(msg):
+        t = time.time()
+        try:
+            yield from handler(msg)
+        except CancelledError:
+            raise
+        except:
+            traceback.print_exc()
+            errors[0] += 1
+        finally:
+            latencies.append(time.time() - t)
+            semaphore.release()
+
+    start = t0 = None
+    for t, update in read(path, codec):
+        if speed:
+            if t0 is None:
+                start, t0 = time.time(), t
+            else:
+                delay = start + (t - t0) / speed - time.time()
+                if delay > 0:
+                    yield from asyncio.sleep(delay, loop=loop)
+        elif start is None:
+            start = time.time()
+
+        if 'message' not in update:
+            continue
+
+        if asyncio.iscoroutinefunction(handler):
+            yield from semaphore.acquire()
+            task = loop.create_task(run(update['message']))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+        else:
+            t = time.time()
+            try:
+                handler(update['message'])
+            except:
+                traceback.print_exc()
+                errors[0] += 1
+            latencies.append(time.time() - t)
+
+    if tasks:
+        yield from asyncio.wait(tasks, loop=loop)
+
+    return report(latencies, time.time() - start if start is not None else 0.0, errors[0])
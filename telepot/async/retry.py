@@ -0,0 +1,32 @@
+import asyncio
+import aiohttp
+from concurrent.futures._base import CancelledError
+import telepot.retry
+
+
+class RetryPolicy(telepot.retry.RetryPolicy):
+    network_errors = (aiohttp.ClientError, asyncio.TimeoutError)
+    unsent_errors = (aiohttp.ClientConnectorError,)
+
+    @asyncio.coroutine
+    def call(self, method, corofunc, *args, **kwargs):
+        attempt = 0
+        while 1:
+            trial = self.breaker.check()
+            try:
+                result = yield from corofunc(*args, **kwargs)
+            except (CancelledError, KeyboardInterrupt):
+                # Interrupted. Nothing is learned about Telegram.
+                if trial:
+                    self.breaker.abort()
+                raise
+            except Exception as e:
+                attempt += 1
+                delay = self._failed(method, attempt, e)
+                if delay is None:
+                    raise
+            else:
+                self.breaker.success()
+                return result
+
+            yield from asyncio.sleep(delay)
@@ -0,0 +1,48 @@
+import asyncio
+import aiohttp.payload
+import telepot.upload
+
+
+# A multipart/form-data request body written piece by piece. File objects are read in the
+# default executor, so a large upload does not block the event loop.
+class MultipartPayload(aiohttp.payload.Payload):
+    def __init__(self, fields, files, chunk_size=65536, loop=None):
+        boundary, parts = telepot.upload.multipart(fields, files)
+        super(MultipartPayload, self).__init__(parts, content_type='multipart/form-data; boundary=%s' % boundary)
+        self._size = telepot.upload.length(parts)
+        self._chunk_size = chunk_size
+        self._loop = loop if loop is not None else asyncio.get_event_loop()
+
+    @asyncio.coroutine
+    def _write_file(self, writer, f):
+        yield from self._loop.run_in_executor(None, f.rewind)
+
+        sent = 0
+        while 1:
+            chunk = yield from self._loop.run_in_executor(None, f.content.read, self._chunk_size)
+            if not chunk:
+                break
+
+            yield from writer.write(chunk)
+            sent += len(chunk)
+            if f.progress:
+                f.progress(sent, f.size)
+
+    @asyncio.coroutine
+    def _write_buffer(self, writer, f):
+        sent = 0
+        for chunk in f.chunks(self._chunk_size):
+            yield from writer.write(chunk)
+            sent += len(chunk)
+            if f.progress:
+                f.progress(sent, f.size)
+
+    @asyncio.coroutine
+    def write(self, writer):
+        for p in self._value:
+            if not isinstance(p, telepot.upload.InputFile):
+                yield from writer.write(p)
+            elif p.isfile():
+                yield from self._write_file(writer, p)
+            else:
+                yield from self._write_buffer(writer, p)
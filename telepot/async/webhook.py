@@ -0,0 +1,110 @@
+import ssl
+import asyncio
+import traceback
+import aiohttp.web
+import telepot.codec
+import telepot.async.executor
+from telepot.webhook import MAX_BODY_SIZE
+
+
+# Receives updates posted by Telegram to `path`, and passes each update's message to
+# `handler`, the same way `messageLoop()` does: a coroutine function is run as a task,
+# a plain function is called right away. At most `concurrency` handlers run at once;
+# beyond that, requests wait, which in turn slows down Telegram. If `lanes` is given,
+# messages are handed to that many lanes instead, keeping each chat's messages in order,
+# and at most `concurrency` messages wait in the lanes.
+# Serves HTTPS if `certfile` is given.
+#
+# Telegram is not told about the webhook. Call `bot.setWebhook()` for that.
+class WebhookServer(object):
+    def __init__(self, path, handler, host='', port=8443, certfile=None, keyfile=None, codec=None, concurrency=100, lanes=None, loop=None):
+        self.path = path if path.startswith('/') else '/' + path
+        self.codec = codec if codec is not None else telepot.codec.get()
+        self._handler = handler
+        self._host = host
+        self._port = port
+        self._loop = loop if loop is not None else asyncio.get_event_loop()
+        self._concurrency = concurrency
+        self._semaphore = asyncio.Semaphore(concurrency, loop=self._loop)
+        self._tasks = set()
+        self._lanes = lanes
+        self._dispatcher = None
+
+        if certfile:
+            self._ssl = ssl.SSLContext(getattr(ssl, 'PROTOCOL_TLS_SERVER', ssl.PROTOCOL_SSLv23))
+            self._ssl.load_cert_chain(certfile, keyfile)
+        else:
+            self._ssl = None
+
+        self._app = aiohttp.web.Application(loop=self._loop, client_max_size=MAX_BODY_SIZE)
+        self._app.router.add_post(self.path, self._receive)
+        self._server = None
+
+    # (host, port) the server is listening on
+    @property
+    def address(self):
+        return self._server.sockets[0].getsockname()[:2]
+
+    @asyncio.coroutine
+    def _receive(self, request):
+        try:
+            update = self.codec.loads((yield from request.read()))
+        except ValueError:
+            return aiohttp.web.Response(status=400)
+
+        if not isinstance(update, dict):
+            return aiohttp.web.Response(status=400)
+
+        # Updates this version does not understand are acknowledged, so they are not sent again.
+        if 'message' in update:
+            if self._dispatcher:
+                yield from self._dispatcher.dispatch(update['message'])
+            else:
+                yield from self._semaphore.acquire()
+                self._dispatch(update['message'])
+
+        return aiohttp.web.Response()
+
+    def _dispatch(self, msg):
+        if asyncio.iscoroutinefunction(self._handler):
+            t = self._loop.create_task(self._handler(msg))
+            self._tasks.add(t)
+            t.add_done_callback(self._done)
+        else:
+            try:
+                self._handler(msg)
+            except:
+                traceback.print_exc()
+            finally:
+                self._semaphore.release()
+
+    def _done(self, task):
+        self._tasks.discard(task)
+        self._semaphore.release()
+
+        if not task.cancelled() and task.exception() is not None:
+            e = task.exception()
+            traceback.print_exception(type(e), e, e.__traceback__)
+
+    @asyncio.coroutine
+    def start(self):
+        if self._lanes:
+            self._dispatcher = telepot.async.executor.ChatDispatcher(self._handler, self._lanes, -(-self._concurrency // self._lanes), self._loop)
+
+        self._request_handler = self._app.make_handler()
+        self._server = yield from self._loop.create_server(self._request_handler, self._host, self._port, ssl=self._ssl)
+
+    # Stop accepting updates, and wait for handlers already running to finish.
+    @asyncio.coroutine
+    def stop(self):
+        self._server.close()
+        yield from self._server.wait_closed()
+        yield from self._app.shutdown()
+        yield from self._request_handler.shutdown(10)
+        yield from self._app.cleanup()
+
+        if self._tasks:
+            yield from asyncio.wait(self._tasks, loop=self._loop)
+
+        if self._dispatcher:
+            yield from self._dispatcher.shutdown()
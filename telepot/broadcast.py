@@ -0,0 +1,135 @@
+import threading
+import telepot
+
+try:
+    import Queue as queue
+except ImportError:
+    import queue
+
+
+# Remembers which recipients have been served, so an interrupted broadcast can resume
+# where it left off. Chat ids are appended to a text file, one per line.
+class Checkpoint(object):
+    def __init__(self, path):
+        self._path = path
+        self._lock = threading.Lock()
+        self._file = None
+
+    def load(self):
+        try:
+            with open(self._path) as f:
+                return set(line.strip() for line in f if line.strip())
+        except IOError:
+            return set()
+
+    def mark(self, chat_id):
+        with self._lock:
+            if self._file is None:
+                self._file = open(self._path, 'a')
+            self._file.write('%s\n' % chat_id)
+            self._file.flush()
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+
+# A recipient is done if the message went through, or if it never will, e.g. bot blocked by user.
+# Transient failures are left for the next run.
+def _settled(e):
+    return (e is None or
+            isinstance(e, telepot.TelegramError) and e.error_code is not None and e.error_code < 500 and e.error_code != 429)
+
+
+_end = object()
+
+# Send the same `payload` to every chat in `chat_ids` using `workers` threads.
+# Yields a tuple of (chat_id, message, exception) for each recipient as soon as it is served.
+# An exception raised by iterating `chat_ids` is raised once those before it are served.
+def broadcast(bot, chat_ids, payload, workers=8, checkpoint=None):
+    done = checkpoint.load() if checkpoint else set()
+    todo = queue.Queue(workers * 2)
+    results = queue.Queue(workers * 2)
+    stopping = threading.Event()
+
+    def put(q, item):
+        # Give up if the consumer has gone away.
+        while not stopping.is_set():
+            try:
+                q.put(item, timeout=0.5)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    error = []  # exception raised by iterating `chat_ids`
+
+    def feed():
+        try:
+            for chat_id in chat_ids:
+                if str(chat_id) in done:
+                    continue
+                if not put(todo, chat_id):
+                    return
+        except Exception as e:
+            error.append(e)
+        finally:
+            for i in range(workers):
+                put(todo, _end)
+
+    alive = [workers]
+    alive_lock = threading.Lock()
+
+    def work():
+        try:
+            while 1:
+                try:
+                    chat_id = todo.get(timeout=0.5)
+                except queue.Empty:
+                    if stopping.is_set():
+                        return
+                    continue
+
+                if chat_id is _end:
+                    return
+
+                p = dict(payload, chat_id=chat_id)
+                try:
+                    msg, e = bot._api_request('sendMessage', p), None
+                except Exception as ex:
+                    msg, e = None, ex
+
+                if checkpoint and _settled(e):
+                    checkpoint.mark(chat_id)
+
+                if not put(results, (chat_id, msg, e)):
+                    return
+        finally:
+            with alive_lock:
+                alive[0] -= 1
+                if alive[0] == 0 and checkpoint:
+                    checkpoint.close()
+
+            put(results, _end)
+
+    threads = [threading.Thread(target=feed)] + [threading.Thread(target=work) for i in range(workers)]
+    for t in threads:
+        t.daemon = True
+        t.start()
+
+    try:
+        remaining = workers
+        while remaining:
+            r = results.get()
+            if r is _end:
+                remaining -= 1
+            else:
+                yield r
+
+        # Recipients before the failure have been served. Let the caller know the rest were not.
+        if error:
+            raise error[0]
+    finally:
+        stopping.set()
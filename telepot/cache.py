@@ -0,0 +1,463 @@
+import io
+import os
+import json
+import time
+import uuid
+import sqlite3
+import hashlib
+import threading
+import collections
+
+
+# A thread-safe dictionary holding at most `maxsize` items. When full, the least recently
+# used item is dropped. If `maxweight` is given, items are also dropped while their total
+# weight, as returned by `weigh(value)`, exceeds it.
+class LRUCache(object):
+    def __init__(self, maxsize=128, maxweight=None, weigh=None):
+        self.maxsize = maxsize
+        self.maxweight = maxweight
+        self._weigh = weigh
+        self._data = collections.OrderedDict()
+        self._weight = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    # Total weight of items held
+    @property
+    def weight(self):
+        return self._weight
+
+    def __len__(self):
+        return len(self._data)
+
+    def get(self, key, default=None):
+        with self._lock:
+            try:
+                value = self._data.pop(key)
+            except KeyError:
+                self.misses += 1
+                return default
+
+            self._data[key] = value  # move to most recent
+            self.hits += 1
+            return value
+
+    def _size(self, value):
+        return self._weigh(value) if self.maxweight is not None else 0
+
+    def put(self, key, value):
+        size = self._size(value)
+
+        with self._lock:
+            if key in self._data:
+                self._weight -= self._size(self._data.pop(key))
+
+            # An item heavier than `maxweight` is not kept, rather than pushing out all others.
+            if self.maxweight is not None and size > self.maxweight:
+                return
+
+            self._data[key] = value
+            self._weight += size
+
+            while len(self._data) > self.maxsize or (self.maxweight is not None and self._weight > self.maxweight):
+                self._weight -= self._size(self._data.popitem(last=False)[1])
+
+    def pop(self, key, default=None):
+        with self._lock:
+            if key not in self._data:
+                return default
+            value = self._data.pop(key)
+            self._weight -= self._size(value)
+            return value
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self._weight = 0
+
+    def keys(self):
+        with self._lock:
+            return list(self._data.keys())
+
+
+# Remembers the JSON form of objects sent repeatedly, e.g. the same keyboard sent with
+# thousands of messages. Objects are recognized by identity, so an object must not be
+# modified after it has been serialized. Pass a new object instead.
+class SerializationCache(object):
+    def __init__(self, dumps, maxsize=128):
+        self._dumps = dumps
+        self._cache = LRUCache(maxsize)
+
+    def dumps(self, obj):
+        entry = self._cache.get(id(obj))
+
+        # Holding a reference to `obj` keeps its id from being reused by another object.
+        if entry is not None and entry[0] is obj:
+            return entry[1]
+
+        s = self._dumps(obj)
+        self._cache.put(id(obj), (obj, s))
+        return s
+
+
+# Remembers the file_id Telegram assigns to uploaded content, so the same content can be sent
+# by file_id instead of being uploaded again. Keys are content hashes. If a `store` is given,
+# entries are also written to it, so they survive a restart. A store needs `get(key)` and
+# `put(key, value)`, and `delete(key)`.
+#
+# file_ids are only valid for the bot that received them. Do not share a cache, or a store,
+# between bots with different tokens.
+class FileIdCache(object):
+    def __init__(self, maxsize=1024, store=None):
+        self._cache = LRUCache(maxsize)
+        self._store = store
+
+    @property
+    def hits(self):
+        return self._cache.hits
+
+    @property
+    def misses(self):
+        return self._cache.misses
+
+    def get(self, key):
+        file_id = self._cache.get(key)
+
+        if file_id is None and self._store is not None:
+            file_id = self._store.get(key)
+            if file_id is not None:
+                self._cache.put(key, file_id)
+
+        return file_id
+
+    def put(self, key, file_id):
+        self._cache.put(key, file_id)
+        if self._store is not None:
+            self._store.put(key, file_id)
+
+    def pop(self, key):
+        self._cache.pop(key)
+        if self._store is not None:
+            self._store.delete(key)
+
+
+# A persistent store for `FileIdCache`, kept in an SQLite database.
+class SQLiteStore(object):
+    def __init__(self, path):
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute('CREATE TABLE IF NOT EXISTS file_ids (key TEXT PRIMARY KEY, file_id TEXT NOT NULL)')
+        self._db.commit()
+
+    def get(self, key):
+        with self._lock:
+            row = self._db.execute('SELECT file_id FROM file_ids WHERE key = ?', (key,)).fetchone()
+        return row[0] if row else None
+
+    def put(self, key, file_id):
+        with self._lock:
+            self._db.execute('INSERT OR REPLACE INTO file_ids (key, file_id) VALUES (?, ?)', (key, file_id))
+            self._db.commit()
+
+    def delete(self, key):
+        with self._lock:
+            self._db.execute('DELETE FROM file_ids WHERE key = ?', (key,))
+            self._db.commit()
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+
+# Read-only methods, and how many seconds their results are kept by default. A file's
+# download link is valid for about an hour, so `getFile` results are dropped a bit earlier.
+DEFAULT_TTLS = {
+    'getMe': 3600,
+    'getFile': 3000,
+    'getUserProfilePhotos': 300,
+}
+
+# Approximate memory taken by a result, measured by its size in JSON
+def _result_size(entry):
+    return len(json.dumps(entry[1], separators=(',',':')))
+
+# Keeps the results of read-only API calls for a while, so repeating a call with the same
+# parameters does not go to Telegram. Holds at most `maxsize` results, and if `maxbytes` is
+# given, results of at most about that many bytes in JSON, dropping the least recently used.
+# Results are shared by all callers and must not be modified.
+# - ttls: dictionary of method name => seconds. Only these methods are cached.
+class ResponseCache(object):
+    def __init__(self, maxsize=1024, ttls=None, maxbytes=None):
+        self._ttls = dict(DEFAULT_TTLS if ttls is None else ttls)
+        self._cache = LRUCache(maxsize, maxbytes, _result_size)
+        self._lock = threading.Lock()
+        self._stats = {m: [0, 0] for m in self._ttls}
+        self._pending = {}  # key => call in progress
+
+    def __len__(self):
+        return len(self._cache)
+
+    # Approximate bytes taken by results, if `maxbytes` is given
+    @property
+    def size(self):
+        return self._cache.weight
+
+    @property
+    def ttls(self):
+        return self._ttls
+
+    def caches(self, method):
+        return method in self._ttls
+
+    def key(self, method, params):
+        return (method,) + tuple(sorted([(k,v) for k,v in (params or {}).items() if v is not None]))
+
+    # Returns None if the result of `key` is not cached, or has expired.
+    def get(self, key):
+        entry = self._cache.get(key)
+
+        if entry is not None and entry[0] <= time.time():
+            self._cache.pop(key)
+            entry = None
+
+        with self._lock:
+            self._stats[key[0]][0 if entry is not None else 1] += 1
+
+        return entry[1] if entry is not None else None
+
+    def put(self, key, result):
+        self._cache.put(key, (time.time() + self._ttls[key[0]], result))
+
+    # Returns the result of `key`, from the cache, or else by calling `call()` and caching
+    # the result. Threads missing the same key at the same time wait for one call.
+    def fetch(self, key, call):
+        while 1:
+            result = self.get(key)
+            if result is not None:
+                return result
+
+            with self._lock:
+                p = self._pending.get(key)
+                leader = p is None
+                if leader:
+                    self._pending[key] = p = _Download()
+
+            if not leader:
+                # If the call failed, fail with the same error. If it was interrupted, try again.
+                result = p.wait()
+                if result is not None:
+                    return result
+                continue
+
+            error = result = None
+            try:
+                result = call()
+                self.put(key, result)
+                return result
+            except BaseException as e:
+                error = e
+                raise
+            finally:
+                with self._lock:
+                    del self._pending[key]
+                p.finish(error, result)
+
+    # Forget cached results of `method`, or of all methods.
+    def invalidate(self, method=None):
+        if method is None:
+            self._cache.clear()
+        else:
+            for key in [k for k in self._cache.keys() if k[0] == method]:
+                self._cache.pop(key)
+
+    @property
+    def hits(self):
+        with self._lock:
+            return sum([s[0] for s in self._stats.values()])
+
+    @property
+    def misses(self):
+        with self._lock:
+            return sum([s[1] for s in self._stats.values()])
+
+    # Dictionary of method name => (hits, misses)
+    def stats(self):
+        with self._lock:
+            return {m: tuple(s) for m,s in self._stats.items()}
+
+
+# Keeps downloaded files in `directory`, so a file_id downloaded before is served from disk
+# without calling `getFile` or going to Telegram. Files take up at most `maxsize` bytes in
+# total, the least recently used being removed first. Each file is downloaded to a temporary
+# name and renamed when complete, so a crash never leaves a partial file in the cache.
+class MediaCache(object):
+    def __init__(self, directory, maxsize=1073741824):
+        self._directory = directory
+        self.maxsize = maxsize
+        self._lock = threading.Lock()
+        self._entries = collections.OrderedDict()  # name => size, least recently used first
+        self._total = 0
+        self._pending = {}  # name => download in progress
+        self.hits = 0
+        self.misses = 0
+
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+        # Pick up files from previous runs. Use is recorded in modification times.
+        found = []
+        for name in os.listdir(directory):
+            path = os.path.join(directory, name)
+            if name.endswith('.tmp'):
+                _remove(path)  # left by an interrupted download
+            else:
+                st = os.stat(path)
+                found.append((st.st_mtime, name, st.st_size))
+
+        for mtime, name, size in sorted(found):
+            self._entries[name] = size
+            self._total += size
+
+        with self._lock:
+            self._evict()
+
+    @property
+    def directory(self):
+        return self._directory
+
+    @property
+    def size(self):
+        return self._total
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _name(self, file_id):
+        return hashlib.sha1(file_id.encode('utf-8')).hexdigest()
+
+    def _evict(self):
+        # The newest file stays, even if it alone is larger than `maxsize`.
+        while self._total > self.maxsize and len(self._entries) > 1:
+            name, size = self._entries.popitem(last=False)
+            self._total -= size
+            _remove(os.path.join(self._directory, name))
+
+    # Returns the cached file of `file_id` opened for reading, or None if not cached.
+    def open(self, file_id):
+        name = self._name(file_id)
+        path = os.path.join(self._directory, name)
+
+        with self._lock:
+            if name not in self._entries:
+                self.misses += 1
+                return None
+
+            self._entries[name] = self._entries.pop(name)
+
+            # Once opened, the file stays readable even if evicted.
+            try:
+                f = io.open(path, 'rb')
+            except (IOError, OSError):
+                self._total -= self._entries.pop(name)
+                self.misses += 1
+                return None
+
+            self.hits += 1
+
+        try:
+            os.utime(path, None)
+        except OSError:
+            pass
+
+        return f
+
+    def _add(self, name, tmp):
+        size = os.path.getsize(tmp)
+        _replace(tmp, os.path.join(self._directory, name))
+
+        with self._lock:
+            self._total += size - self._entries.pop(name, 0)
+            self._entries[name] = size
+            self._evict()
+
+    def _begin(self, name):
+        with self._lock:
+            if name in self._pending:
+                return self._pending[name], False
+
+            self._pending[name] = p = _Download()
+            return p, True
+
+    def _end(self, name, p, error):
+        with self._lock:
+            del self._pending[name]
+        p.finish(error)
+
+    def _tempfile(self, name):
+        return os.path.join(self._directory, '%s.%s.tmp' % (name, uuid.uuid4().hex))
+
+    # Returns the cached file of `file_id` opened for reading. If it is not cached, it is
+    # downloaded by calling `download(path)`, which should save the file at `path`.
+    # Threads asking for the same file_id at the same time wait for one download.
+    def fetch(self, file_id, download):
+        name = self._name(file_id)
+
+        while 1:
+            f = self.open(file_id)
+            if f is not None:
+                return f
+
+            p, leader = self._begin(name)
+            if not leader:
+                p.wait()
+                continue
+
+            error = None
+            tmp = self._tempfile(name)
+            try:
+                download(tmp)
+                self._add(name, tmp)
+            except BaseException as e:
+                error = e
+                _remove(tmp)
+                raise
+            finally:
+                self._end(name, p, error)
+
+    def clear(self):
+        with self._lock:
+            for name in self._entries:
+                _remove(os.path.join(self._directory, name))
+            self._entries.clear()
+            self._total = 0
+
+
+# A download, or call, that other threads are waiting for. If it fails, they fail with the
+# same error. Otherwise, they get its result.
+class _Download(object):
+    def __init__(self):
+        self._event = threading.Event()
+        self._error = None
+        self._result = None
+
+    def finish(self, error, result=None):
+        self._error = error
+        self._result = result
+        self._event.set()
+
+    def wait(self):
+        self._event.wait()
+        if isinstance(self._error, Exception):
+            raise self._error
+        return self._result
+
+
+def _remove(path):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+# Rename, overwriting `dest` if it exists
+_replace = getattr(os, 'replace', os.rename)
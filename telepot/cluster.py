@@ -0,0 +1,422 @@
+import time
+import uuid
+import zlib
+import socket
+import threading
+import traceback
+import collections
+import telepot.codec
+import telepot.offset
+import telepot.executor
+
+try:
+    import socketserver
+except ImportError:
+    import SocketServer as socketserver
+
+
+def _crc(s):
+    return zlib.crc32(s.encode('utf-8')) & 0xffffffff
+
+# Partition of `msg`. Messages of a chat always fall in the same partition, on every node.
+def partition_of(msg, partitions):
+    key = telepot.executor.chat_key(msg)
+    return _crc(str(key)) % partitions if key is not None else 0
+
+# Node owning `partition`, by rendezvous hashing: every node computes the same owner from
+# the same members, and a node joining or leaving only moves the partitions it gains or loses.
+def owner_of(partition, members):
+    if not members:
+        return None
+    return max(members, key=lambda node: _crc('%s:%d' % (node, partition)))
+
+
+# Keeps the state shared by nodes, in memory. Stands in for a real broker in tests and on a
+# single host, either in-process or served to other processes by `BrokerServer`.
+#
+# A broker must provide these methods. Times are measured by the broker, so nodes need not
+# agree on the time.
+#   - heartbeat(node_id, ttl): keep `node_id` a member for `ttl` seconds. Returns the members.
+#   - leave(node_id)
+#   - members(): ids of nodes alive, sorted
+#   - lead(node_id, ttl): make `node_id` the leader for `ttl` seconds, unless another node
+#     is. Returns the leader.
+#   - resign(node_id): give up leadership, if `node_id` has it.
+#   - publish(partition, msg)
+#   - receive(partitions, timeout): waits up to `timeout` seconds for messages in any of
+#     `partitions`, and takes them. Returns a list of [partition, msg].
+#   - load_offset(), save_offset(state): the state of the update offset, as in `telepot.offset`.
+#     `load_offset()` returns None until a state is saved.
+class LocalBroker(object):
+    def __init__(self):
+        self._lock = threading.Condition(threading.Lock())
+        self._members = {}  # node id -> expiry time
+        self._leader = None
+        self._lease = 0
+        self._queues = collections.defaultdict(collections.deque)
+        self._offset = None
+
+    def _expire(self, now):
+        for node in [n for n, t in self._members.items() if t <= now]:
+            del self._members[node]
+
+    def heartbeat(self, node_id, ttl):
+        with self._lock:
+            now = time.time()
+            self._members[node_id] = now + ttl
+            self._expire(now)
+            return sorted(self._members)
+
+    def leave(self, node_id):
+        with self._lock:
+            self._members.pop(node_id, None)
+
+    def members(self):
+        with self._lock:
+            self._expire(time.time())
+            return sorted(self._members)
+
+    def lead(self, node_id, ttl):
+        with self._lock:
+            now = time.time()
+            if self._leader is None or self._leader == node_id or self._lease <= now:
+                self._leader, self._lease = node_id, now + ttl
+            return self._leader
+
+    def resign(self, node_id):
+        with self._lock:
+            if self._leader == node_id:
+                self._leader = None
+
+    def publish(self, partition, msg):
+        with self._lock:
+            self._queues[partition].append(msg)
+            self._lock.notify_all()
+
+    def _take(self, partitions):
+        taken = []
+        for p in partitions:
+            q = self._queues.get(p)
+            while q:
+                taken.append([p, q.popleft()])
+        return taken
+
+    def receive(self, partitions, timeout):
+        with self._lock:
+            deadline = time.time() + timeout
+            taken = self._take(partitions)
+            while not taken:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    break
+                self._lock.wait(remaining)
+                taken = self._take(partitions)
+            return taken
+
+    def load_offset(self):
+        with self._lock:
+            return self._offset
+
+    def save_offset(self, state):
+        with self._lock:
+            self._offset = state
+
+
+# Methods a `BrokerServer` serves
+_OPERATIONS = frozenset(['heartbeat', 'leave', 'members', 'lead', 'resign', 'publish', 'receive', 'load_offset', 'save_offset'])
+
+
+class _BrokerHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        codec, broker = self.server.codec, self.server.broker
+
+        while 1:
+            line = self.rfile.readline()
+            if not line:
+                return
+
+            try:
+                request = codec.loads(line)
+                if request['op'] not in _OPERATIONS:
+                    raise ValueError('Unknown operation: %s' % request['op'])
+                response = {'result': getattr(broker, request['op'])(*request['args'])}
+            except Exception as e:
+                response = {'error': str(e)}
+
+            self.wfile.write((codec.dumps(response) + '\n').encode('utf-8'))
+            self.wfile.flush()
+
+
+class _ThreadingTCPServer(socketserver.ThreadingMixIn, socketserver.TCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+if hasattr(socketserver, 'UnixStreamServer'):
+    class _ThreadingUnixServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+        daemon_threads = True
+
+
+# Serves `broker` on `address`, a (host, port) tuple for TCP, or a path for a Unix socket.
+# Requests and responses are JSON, one per line.
+class BrokerServer(object):
+    def __init__(self, broker, address=('127.0.0.1', 0), codec=None):
+        if isinstance(address, tuple):
+            self._server = _ThreadingTCPServer(address, _BrokerHandler)
+        else:
+            self._server = _ThreadingUnixServer(address, _BrokerHandler)
+
+        self._server.broker = broker
+        self._server.codec = codec if codec is not None else telepot.codec.get()
+        self._thread = None
+
+    # Address to give `RemoteBroker`
+    @property
+    def address(self):
+        return self._server.server_address
+
+    def start(self):
+        t = threading.Thread(target=self._server.serve_forever)
+        t.daemon = True
+        t.start()
+        self._thread = t
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+        self._thread.join()
+
+
+class BrokerError(Exception):
+    pass
+
+
+# Talks to a `BrokerServer`. Each thread has a connection of its own, so a thread waiting
+# in `receive()` does not hold up the others. A broken connection is opened again on the next call.
+class RemoteBroker(object):
+    def __init__(self, address, timeout=30, codec=None):
+        self._address = tuple(address) if isinstance(address, (tuple, list)) else address
+        self._timeout = timeout
+        self._codec = codec if codec is not None else telepot.codec.get()
+        self._local = threading.local()
+
+    def _connect(self):
+        family = socket.AF_INET if isinstance(self._address, tuple) else socket.AF_UNIX
+        s = socket.socket(family, socket.SOCK_STREAM)
+        s.settimeout(self._timeout)
+        s.connect(self._address)
+        return s, s.makefile('rb')
+
+    def _call(self, op, *args):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = self._local.conn = self._connect()
+
+        s, f = conn
+        try:
+            s.sendall((self._codec.dumps({'op': op, 'args': args}) + '\n').encode('utf-8'))
+            line = f.readline()
+            if not line:
+                raise BrokerError('Connection closed by broker')
+        except:
+            self._local.conn = None
+            f.close()
+            s.close()
+            raise
+
+        response = self._codec.loads(line)
+        if 'error' in response:
+            raise BrokerError(response['error'])
+        return response['result']
+
+    def heartbeat(self, node_id, ttl):
+        return self._call('heartbeat', node_id, ttl)
+
+    def leave(self, node_id):
+        return self._call('leave', node_id)
+
+    def members(self):
+        return self._call('members')
+
+    def lead(self, node_id, ttl):
+        return self._call('lead', node_id, ttl)
+
+    def resign(self, node_id):
+        return self._call('resign', node_id)
+
+    def publish(self, partition, msg):
+        return self._call('publish', partition, msg)
+
+    # `timeout` should be well below the connection's.
+    def receive(self, partitions, timeout):
+        return self._call('receive', list(partitions), timeout)
+
+    def load_offset(self):
+        return self._call('load_offset')
+
+    def save_offset(self, state):
+        return self._call('save_offset', state)
+
+
+# Keeps the update offset in the broker, along with updates not yet published, so a new
+# leader resumes polling where the last left off, and publishes those first.
+class _BrokerOffsetStore(object):
+    def __init__(self, broker):
+        self._broker = broker
+
+    def load(self):
+        state = self._broker.load_offset()
+        return tuple(state) if state is not None else None
+
+    def save(self, offset, updates):
+        self._broker.save_offset([offset, updates])
+
+
+# One of several nodes sharing a bot through `broker`. Nodes elect a leader, the only one
+# to poll for updates. It publishes each message to a partition, by chat id. The partitions
+# are divided among the nodes alive, and each node passes messages of the partitions it owns
+# to `handler`, `bot.handle` by default, so a `DelegatorBot` sees all of a chat's messages.
+# When a node joins or leaves, or stops sending heartbeats for `ttl` seconds, partitions are
+# divided again, and leadership moves if needed. Messages waiting in a partition go to its
+# new owner.
+#
+# To receive updates by webhook instead, give `put` as the callback to `notifyOnWebhook()`
+# on any host.
+class Node(object):
+    def __init__(self, bot, broker, handler=None, node_id=None, partitions=64, ttl=10, relax=0.1, timeout=20):
+        self.bot = bot
+        self.broker = broker
+        self.node_id = node_id if node_id is not None else uuid.uuid4().hex
+        self._handler = handler if handler is not None else bot.handle
+        self._partitions = partitions
+        self._ttl = ttl
+        self._relax = relax
+        self._timeout = max(1, int(min(timeout, ttl // 2)))  # so a deposed leader soon notices
+
+        self._lock = threading.Lock()
+        self._members = []
+        self._owned = []
+        self._leader = False
+        self._poller = None
+        self._running = False
+
+    @property
+    def members(self):
+        with self._lock:
+            return list(self._members)
+
+    # Partitions this node handles
+    @property
+    def partitions(self):
+        with self._lock:
+            return list(self._owned)
+
+    @property
+    def is_leader(self):
+        return self._leader
+
+    # Publish `msg` to its partition.
+    def put(self, msg):
+        self.broker.publish(partition_of(msg, self._partitions), msg)
+
+    def _spawn(self, target):
+        t = threading.Thread(target=target)
+        t.daemon = True
+        t.start()
+        return t
+
+    def _beat(self):
+        members = self.broker.heartbeat(self.node_id, self._ttl)
+        owned = [p for p in range(self._partitions) if owner_of(p, members) == self.node_id]
+
+        with self._lock:
+            self._members, self._owned = members, owned
+
+        self._leader = self.broker.lead(self.node_id, self._ttl) == self.node_id
+
+        # A poller that lost leadership may still be finishing its last poll.
+        if self._leader and not (self._poller and self._poller.is_alive()):
+            self._poller = self._spawn(self._poll)
+
+    def _heartbeat(self):
+        while self._running:
+            time.sleep(self._ttl / 3.0)
+            try:
+                self._beat()
+            except:
+                # Stop polling, as another node may soon take over.
+                traceback.print_exc()
+                self._leader = False
+
+    # Publish `msg`, trying again until it is published. Returns False if leadership is lost first.
+    def _publish(self, msg):
+        while self._running and self._leader:
+            try:
+                self.put(msg)
+                return True
+            except:
+                traceback.print_exc()
+                time.sleep(self._relax)
+        return False
+
+    def _poll(self):
+        tracker = telepot.offset.OffsetTracker(_BrokerOffsetStore(self.broker))
+
+        # Until it is published, an update stays in the broker's offset state. If leadership
+        # is lost, the next leader publishes it first.
+        def publish(updates):
+            for update in updates:
+                if 'message' in update and not self._publish(update['message']):
+                    return False
+
+                tracker.done(update['update_id'])
+            return True
+
+        if not publish(tracker.recover()):
+            return
+
+        while self._running and self._leader:
+            try:
+                result = self.bot.getUpdates(offset=tracker.offset, timeout=self._timeout)
+
+                if not publish(tracker.accept(result)):
+                    return
+            except:
+                traceback.print_exc()
+                time.sleep(self._relax)
+            else:
+                if not result:
+                    time.sleep(self._relax)
+
+    def _receive(self):
+        while self._running:
+            try:
+                # Wait briefly, to pick up partitions gained.
+                taken = self.broker.receive(self.partitions, 1)
+            except:
+                traceback.print_exc()
+                time.sleep(self._relax)
+                continue
+
+            for partition, msg in taken:
+                try:
+                    self._handler(msg)
+                except:
+                    # Localize the error so the node can keep going.
+                    traceback.print_exc()
+
+    def start(self):
+        self._running = True
+        self._beat()
+        self._spawn(self._heartbeat)
+        self._spawn(self._receive)
+
+    # Leave the cluster, so other nodes take over this one's partitions, and leadership.
+    def stop(self):
+        self._running = False
+        self._leader = False
+        try:
+            self.broker.resign(self.node_id)
+            self.broker.leave(self.node_id)
+        except:
+            traceback.print_exc()
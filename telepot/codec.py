@@ -0,0 +1,65 @@
+import sys
+import json
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import ujson
+except ImportError:
+    ujson = None
+
+
+# A codec turns response bodies (bytes) into Python objects, and parameters into JSON strings.
+# Decoding errors must be raised as `ValueError`, or a subclass of it.
+
+class StdlibCodec(object):
+    name = 'json'
+
+    def loads(self, data):
+        # Python 3 before 3.6 does not accept bytes.
+        if sys.version_info >= (3,) and type(data) is bytes:
+            data = data.decode('utf-8')
+        return json.loads(data)
+
+    def dumps(self, obj):
+        return json.dumps(obj, separators=(',',':'))
+
+
+class UjsonCodec(object):
+    name = 'ujson'
+
+    def loads(self, data):
+        return ujson.loads(data)
+
+    def dumps(self, obj):
+        return ujson.dumps(obj, ensure_ascii=False, escape_forward_slashes=False)
+
+
+class OrjsonCodec(object):
+    name = 'orjson'
+
+    def loads(self, data):
+        return orjson.loads(data)
+
+    def dumps(self, obj):
+        return orjson.dumps(obj).decode('utf-8')
+
+
+# In order of preference
+_codecs = [(OrjsonCodec, orjson), (UjsonCodec, ujson), (StdlibCodec, json)]
+
+def available():
+    return [cls.name for cls, module in _codecs if module is not None]
+
+# Returns the codec of the given name, or the fastest one installed if `name` is None.
+def get(name=None):
+    for cls, module in _codecs:
+        if module is None:
+            continue
+        if name is None or name == cls.name:
+            return cls()
+
+    raise ValueError('JSON codec not available: %s' % name)
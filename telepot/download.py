@@ -0,0 +1,322 @@
+import os
+import sys
+import mmap
+import shutil
+import socket
+import threading
+import requests
+import telepot
+from telepot.upload import _isfile
+
+PY_3 = sys.version_info.major >= 3
+
+# Parallel downloads split a file into segments of at least this many bytes.
+MIN_SEGMENT_SIZE = 1048576
+
+_network_errors = (requests.exceptions.RequestException,
+                   requests.packages.urllib3.exceptions.HTTPError,
+                   socket.error)
+
+
+class IncompleteDownload(telepot.TelepotException):
+    def __init__(self, received, expected):
+        super(IncompleteDownload, self).__init__(received, expected)
+
+    @property
+    def received(self):
+        return self.args[0]
+
+    @property
+    def expected(self):
+        return self.args[1]
+
+
+# Downloaded bytes go into a file ...
+class FileSink(object):
+    view = None
+
+    def __init__(self, f):
+        self._f = f
+        self._lock = threading.Lock()
+
+        # Offsets are counted from where the file is positioned. A file that cannot seek
+        # (e.g. a pipe) can only be written in order.
+        try:
+            self._base = f.tell()
+        except (IOError, OSError, AttributeError):
+            self._base = None
+        self._pos = 0
+
+    @property
+    def seekable(self):
+        return self._base is not None
+
+    def write(self, offset, data):
+        with self._lock:
+            if offset != self._pos:
+                self._f.seek(self._base + offset)
+            self._f.write(data if PY_3 else data.tobytes())
+            self._pos = offset + len(data)
+
+
+# ... or into a writable buffer, e.g. a bytearray or mmap, without going through a
+# temporary chunk.
+class BufferSink(object):
+    seekable = True
+
+    def __init__(self, buf):
+        self._buf = buf
+
+        try:
+            view = memoryview(buf)
+        except TypeError:
+            view = None  # Python 2 mmap does not support memoryview
+
+        if view is not None and PY_3 and view.format != 'B':
+            view = view.cast('B')
+        self.view = view
+
+    def __len__(self):
+        return len(self.view) if self.view is not None else len(self._buf)
+
+    # A memory map cannot be closed while a view of it exists. Python 2 views need no release.
+    def release(self):
+        if self.view is not None:
+            if PY_3:
+                self.view.release()
+            self.view = None
+
+    def write(self, offset, data):
+        if self.view is not None:
+            self.view[offset:offset+len(data)] = data
+        else:
+            self._buf[offset:offset+len(data)] = data.tobytes()
+
+
+def is_buffer(obj):
+    return isinstance(obj, (bytearray, memoryview, mmap.mmap))
+
+
+# Returns a sink for `dest`, and a function to call when done with it. A path is opened,
+# and preallocated to `size` if known. In Python 3, it is memory-mapped so data is read
+# straight into the file's pages.
+def open_sink(dest, size):
+    if _isfile(dest):
+        return FileSink(dest), lambda: None
+
+    if is_buffer(dest):
+        sink = BufferSink(dest)
+        if size is not None and len(sink) < size:
+            raise ValueError('Buffer too small: %d bytes for a file of %d bytes' % (len(sink), size))
+        return sink, sink.release
+
+    f = open(dest, 'w+b' if size else 'wb')
+    try:
+        if size:
+            f.truncate(size)
+
+        if size and PY_3:
+            m = mmap.mmap(f.fileno(), size)
+            sink = BufferSink(m)
+            def close():
+                sink.release()
+                m.close()
+                f.close()
+            return sink, close
+        else:
+            return FileSink(f), f.close
+    except:
+        f.close()
+        raise
+
+
+# Copy the open file `src`, e.g. from a `MediaCache`, into `dest`, which may be a path,
+# a file object or a writable buffer.
+def copy(src, dest, chunk_size=65536):
+    if _isfile(dest):
+        shutil.copyfileobj(src, dest, chunk_size)
+    elif is_buffer(dest):
+        size = os.fstat(src.fileno()).st_size
+        sink, close = open_sink(dest, size)
+        try:
+            if sink.view is not None:
+                src.readinto(sink.view[:size])
+            else:
+                sink.write(0, memoryview(src.read()))
+        finally:
+            close()
+    else:
+        with open(dest, 'wb') as f:
+            shutil.copyfileobj(src, f, chunk_size)
+
+
+# Split `size` bytes into at most `parallel` ranges of (start, end)
+def segments(size, parallel):
+    if size is None:
+        return [(0, None)]
+
+    n = max(1, min(parallel, size // MIN_SEGMENT_SIZE))
+    bounds = [size * i // n for i in range(n+1)]
+    return list(zip(bounds[:-1], bounds[1:]))
+
+
+def range_header(pos, end):
+    return 'bytes=%d-%s' % (pos, '' if end is None else end-1)
+
+
+# Copy the response body into `sink`, from `pos` up to `end`, reading straight into the
+# sink's buffer if it has one, otherwise through `chunk`. If the server ignored the Range
+# header (status 200), the body starts at 0, so the first `pos` bytes are skipped.
+# Returns the new position, and the network error that stopped the copy, if any.
+def _copy(raw, status, sink, pos, end, chunk):
+    skip = pos if status == 200 else 0
+
+    while end is None or pos < end:
+        n = len(chunk) if end is None else min(len(chunk), end - pos)
+
+        if skip:
+            target = chunk[:min(n, skip)]
+        elif sink.view is not None:
+            target = sink.view[pos:pos+n]
+        else:
+            target = chunk[:n]
+
+        try:
+            got = raw.readinto(target)
+        except _network_errors as e:
+            return pos, e
+
+        if not got:
+            return pos, None if end is None else IncompleteDownload(pos, end)
+
+        if skip:
+            skip -= got
+            continue
+
+        if sink.view is None:
+            sink.write(pos, target[:got])
+        pos += got
+
+    return pos, None
+
+
+# Download the range from `start` to `end` (None meaning the end of file) into `sink`. If the
+# connection breaks, it is picked up where it left off with a Range request. Gives up after
+# `retries` attempts in a row that make no progress.
+def fetch(session, url, sink, start, end, chunk_size, timeout, retries=3):
+    chunk = memoryview(bytearray(chunk_size))
+    pos, failures = start, 0
+
+    while 1:
+        # Compressed bodies cannot be resumed, so ask for the file as it is.
+        headers = {'Accept-Encoding': 'identity'}
+        if pos > 0 or end is not None:
+            headers['Range'] = range_header(pos, end)
+
+        try:
+            r = session.get(url, headers=headers, stream=True, timeout=timeout)
+        except _network_errors as e:
+            error = e
+        else:
+            try:
+                if r.status_code not in (200, 206):
+                    raise telepot.BadHTTPResponse(r.status_code, r.text)
+
+                p, error = _copy(r.raw, r.status_code, sink, pos, end, chunk)
+            finally:
+                r.close()
+
+            if p > pos:
+                pos, failures = p, 0
+
+        if error is None:
+            return
+
+        failures += 1
+        if failures > retries:
+            raise error
+
+
+# Download `url` into `dest`, which may be a path, a file object or a writable buffer.
+# If `size` is known and `parallel` is more than 1, segments of the file are fetched
+# at the same time.
+def download(session, url, dest, size, chunk_size, timeout, parallel=1, retries=3):
+    sink, close = open_sink(dest, size)
+    try:
+        ranges = segments(size, parallel if sink.seekable else 1)
+
+        if len(ranges) == 1:
+            fetch(session, url, sink, ranges[0][0], ranges[0][1], chunk_size, timeout, retries)
+            return
+
+        errors = []
+        def run(start, end):
+            try:
+                fetch(session, url, sink, start, end, chunk_size, timeout, retries)
+            except Exception as e:
+                errors.append(e)
+
+        threads = [threading.Thread(target=run, args=r) for r in ranges]
+        for t in threads:
+            t.daemon = True
+            t.start()
+        for t in threads:
+            t.join()
+
+        if errors:
+            raise errors[0]
+    finally:
+        close()
+
+
+# Yield the file at `url` chunk by chunk. Nothing is read from the connection until the
+# consumer asks for the next chunk, so a slow consumer holds back the download instead of
+# letting data pile up in memory. A broken connection is resumed where it left off.
+def chunks(session, url, size, chunk_size, timeout, retries=3):
+    pos, failures = 0, 0
+
+    while size is None or pos < size:
+        headers = {'Accept-Encoding': 'identity'}
+        if pos > 0:
+            headers['Range'] = range_header(pos, None)
+
+        try:
+            r = session.get(url, headers=headers, stream=True, timeout=timeout)
+        except _network_errors as e:
+            error = e
+        else:
+            try:
+                if r.status_code not in (200, 206):
+                    raise telepot.BadHTTPResponse(r.status_code, r.text)
+
+                skip = pos if r.status_code == 200 else 0
+                error = None
+
+                while size is None or pos < size:
+                    try:
+                        data = r.raw.read(chunk_size)
+                    except _network_errors as e:
+                        error = e
+                        break
+
+                    if not data:
+                        if size is None:
+                            return
+                        error = IncompleteDownload(pos, size)
+                        break
+
+                    # Server ignored the Range header
+                    if skip:
+                        data, skip = data[skip:], max(0, skip - len(data))
+                        if not data:
+                            continue
+
+                    pos, failures = pos + len(data), 0
+                    yield data
+            finally:
+                r.close()
+
+        if error is not None:
+            failures += 1
+            if failures > retries:
+                raise error
@@ -0,0 +1,135 @@
+import threading
+import itertools
+from concurrent.futures import Future
+import telepot.ratelimit
+
+try:
+    import Queue as queue
+except ImportError:
+    import queue
+
+
+# Runs callables on a fixed number of threads, called lanes. Work submitted with the same
+# key always goes to the same lane, so it is executed in the order submitted. Work with
+# different keys runs in parallel, as long as the keys fall on different lanes.
+class OrderedExecutor(object):
+    def __init__(self, lanes=8, maxsize=0):
+        self._queues = [queue.Queue(maxsize) for i in range(lanes)]
+        self._counter = itertools.count()
+        self._shutdown = False
+        self._threads = []
+
+        for q in self._queues:
+            t = threading.Thread(target=self._work, args=(q,))
+            t.daemon = True
+            t.start()
+            self._threads.append(t)
+
+    @property
+    def lanes(self):
+        return len(self._queues)
+
+    def _work(self, q):
+        while 1:
+            item = q.get()
+            if item is None:
+                return
+
+            f, fn, args, kwargs = item
+            if not f.set_running_or_notify_cancel():
+                continue
+
+            try:
+                f.set_result(fn(*args, **kwargs))
+            except BaseException as e:
+                f.set_exception(e)
+
+    # Number of items waiting in all lanes
+    def qsize(self):
+        return sum([q.qsize() for q in self._queues])
+
+    def lane_of(self, key):
+        if key is None:
+            return next(self._counter) % len(self._queues)
+        else:
+            return hash(key) % len(self._queues)
+
+    # Returns a `concurrent.futures.Future`. A `key` of None means no ordering is required.
+    def submit(self, key, fn, *args, **kwargs):
+        if self._shutdown:
+            raise RuntimeError('Cannot submit after shutdown')
+
+        f = Future()
+        self._queues[self.lane_of(key)].put((f, fn, args, kwargs))
+        return f
+
+    def shutdown(self, wait=True):
+        self._shutdown = True
+        for q in self._queues:
+            q.put(None)
+
+        if wait:
+            for t in self._threads:
+                t.join()
+
+
+# Key that keeps a message in order with others of the same chat
+def chat_key(msg):
+    try:
+        return msg['chat']['id']
+    except (KeyError, TypeError):
+        return None
+
+
+_chat_methods = telepot.ratelimit.SEND_METHODS | frozenset(['sendChatAction'])
+
+_other_methods = frozenset(['getMe',
+                            'getUserProfilePhotos',
+                            'getFile',
+                            'getUpdates',
+                            'setWebhook',
+                            'downloadFile',
+                            'streamFile',])
+
+# Methods that do not block, and are passed to the bot as they are
+_direct_methods = frozenset(['broadcast'])
+
+
+# Wraps a bot so every API method returns a `concurrent.futures.Future` immediately,
+# instead of blocking for the round trip. Calls aimed at the same chat are carried out
+# in order; calls aimed at different chats proceed in parallel.
+#
+#   fb = FutureBot(bot)
+#   f = fb.sendMessage(chat_id, 'Hello')
+#   f.add_done_callback(lambda f: print(f.result()))
+class FutureBot(object):
+    def __init__(self, bot, lanes=8, executor=None):
+        self._bot = bot
+        self._executor = executor if executor is not None else OrderedExecutor(lanes)
+
+    @property
+    def bot(self):
+        return self._bot
+
+    @property
+    def executor(self):
+        return self._executor
+
+    def __getattr__(self, name):
+        if name in _chat_methods:
+            def submit(*args, **kwargs):
+                chat_id = args[0] if args else kwargs.get('chat_id')
+                return self._executor.submit(chat_id, getattr(self._bot, name), *args, **kwargs)
+        elif name in _other_methods:
+            def submit(*args, **kwargs):
+                return self._executor.submit(None, getattr(self._bot, name), *args, **kwargs)
+        elif name in _direct_methods:
+            return getattr(self._bot, name)
+        else:
+            raise AttributeError(name)
+
+        submit.__name__ = name
+        return submit
+
+    def shutdown(self, wait=True):
+        self._executor.shutdown(wait)
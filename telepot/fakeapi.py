@@ -0,0 +1,525 @@
+import re
+import ssl
+import sys
+import errno
+import socket
+import time
+import random
+import threading
+import traceback
+import collections
+import telepot.codec
+import telepot.ratelimit
+from telepot.webhook import _ThreadingHTTPServer
+
+PY_3 = sys.version_info.major >= 3
+
+try:
+    from BaseHTTPServer import BaseHTTPRequestHandler
+    from urlparse import urlparse, parse_qsl
+    from urllib2 import Request, urlopen
+except ImportError:
+    from http.server import BaseHTTPRequestHandler
+    from urllib.parse import urlparse, parse_qsl
+    from urllib.request import Request, urlopen
+
+
+# Methods sending a message, and the field holding the file they send, if any
+_SEND_METHODS = {'sendMessage': None,
+                 'forwardMessage': None,
+                 'sendPhoto': 'photo',
+                 'sendAudio': 'audio',
+                 'sendDocument': 'document',
+                 'sendSticker': 'sticker',
+                 'sendVideo': 'video',
+                 'sendVoice': 'voice',
+                 'sendLocation': None,}
+
+_PATH = re.compile(r'^/(file/)?bot([^/]+)/(.+)$')
+
+
+# Parses a query string or form body. On Python 2, fields are split as bytes, then decoded,
+# so non-ASCII text comes out right.
+def _form(data):
+    if PY_3:
+        return dict(parse_qsl(data.decode('latin-1') if isinstance(data, bytes) else data))
+    else:
+        return dict([(k.decode('utf-8'), v.decode('utf-8')) for k,v in parse_qsl(data)])
+
+
+class _Server(_ThreadingHTTPServer):
+    def __init__(self, *args):
+        _ThreadingHTTPServer.__init__(self, *args)
+        self.lock = threading.Lock()
+        self.connections = {}  # socket => thread serving it
+
+    # Break off connections kept alive by clients, and wait up to `timeout` seconds for
+    # their threads to finish, so none is left to fail at interpreter shutdown.
+    def close_connections(self, timeout):
+        with self.lock:
+            connections = list(self.connections.items())
+
+        for sock, thread in connections:
+            try:
+                sock.shutdown(socket.SHUT_RDWR)
+            except (socket.error, IOError):
+                pass
+
+        deadline = time.time() + timeout
+        for sock, thread in connections:
+            thread.join(max(0, deadline - time.time()))
+
+    # A client giving up on a long poll is no error. Keep it out of benchmark output.
+    def handle_error(self, request, client_address):
+        e = sys.exc_info()[1]
+        if isinstance(e, (socket.error, IOError)) and e.errno in (errno.EPIPE, errno.ECONNRESET):
+            return
+        _ThreadingHTTPServer.handle_error(self, request, client_address)
+
+
+class _Failure(Exception):
+    def __init__(self, error_code, description, parameters=None):
+        super(_Failure, self).__init__(error_code, description, parameters)
+        self.error_code = error_code
+        self.description = description
+        self.parameters = parameters
+
+
+def _multipart(body, content_type):
+    boundary = content_type.split('boundary=', 1)[1].strip('"').encode('ascii')
+    fields, files = {}, {}
+
+    for part in body.split(b'--' + boundary)[1:-1]:
+        head, _, content = part[2:].partition(b'\r\n\r\n')
+        content = content[:-2]  # CRLF before the next boundary
+
+        disposition = [h for h in head.decode('utf-8').split('\r\n') if h.lower().startswith('content-disposition')][0]
+        name = re.search(r'\bname="([^"]*)"', disposition).group(1)
+        filename = re.search(r'\bfilename="([^"]*)"', disposition)
+
+        if filename:
+            files[name] = (filename.group(1), content)
+        else:
+            fields[name] = content.decode('utf-8')
+
+    return fields, files
+
+
+# State of one bot, by token
+class _Bot(object):
+    def __init__(self, token, id):
+        self.token = token
+        self.id = id
+        self.lock = threading.Condition(threading.Lock())
+        self.updates = collections.deque()
+        self.next_update_id = 1
+        self.next_message_id = 1
+        self.webhook = None
+        self.webhook_thread = None
+        self.sent = []
+        self.buckets = {}
+
+
+# A stand-in for the Bot API, served over HTTP on `host` and `port`, for tests and benchmarks
+# that must not, or cannot, reach Telegram. Point a bot at it with `base_url=server.url`.
+#
+# It answers `getMe`, `getUpdates` (long-polling), the send methods, `sendChatAction`,
+# `getFile`, `setWebhook`, and file downloads. Updates are made up by calling `message()`,
+# and delivered to the webhook if one is set. Each call waits `latency` seconds, or a random
+# time in a (min, max) range, and fails with a server error with probability `error_rate`.
+# If `chat_limit` is given, as (rate per second, burst), messages to a chat beyond that
+# limit are refused with 429 and a `retry_after`, like Telegram does.
+class FakeBotAPI(object):
+    def __init__(self, host='127.0.0.1', port=0, latency=0, error_rate=0.0, chat_limit=None, codec=None):
+        self.codec = codec if codec is not None else telepot.codec.get()
+        self.latency = latency
+        self.error_rate = error_rate
+        self.chat_limit = chat_limit
+
+        self._lock = threading.Lock()
+        self._bots = {}
+        self._files = {}  # file id -> content
+        self._injected = []  # [method, count, failure]
+        self._calls = collections.Counter()
+        self._running = False
+
+        self._httpd = _Server((host, port), _make_handler(self))
+        self._thread = None
+
+    @property
+    def url(self):
+        return 'http://%s:%d' % self._httpd.server_address[:2]
+
+    def start(self):
+        self._running = True
+        t = threading.Thread(target=self._httpd.serve_forever)
+        t.daemon = True
+        t.start()
+        self._thread = t
+
+    def stop(self):
+        self._running = False
+        self._httpd.shutdown()
+        self._httpd.server_close()
+        self._thread.join()
+
+        # Release long polls and webhook deliveries.
+        for bot in list(self._bots.values()):
+            with bot.lock:
+                bot.lock.notify_all()
+
+        self._httpd.close_connections(5)
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+
+    def _bot(self, token):
+        with self._lock:
+            try:
+                return self._bots[token]
+            except KeyError:
+                b = self._bots[token] = _Bot(token, len(self._bots) + 1)
+                return b
+
+    # Make up an update for the bot with `token`. Returns the update.
+    def push(self, token, message):
+        bot = self._bot(token)
+        with bot.lock:
+            update = {'update_id': bot.next_update_id, 'message': message}
+            bot.next_update_id += 1
+            bot.updates.append(update)
+            bot.lock.notify_all()
+        return update
+
+    # Make up a text message from `chat_id` to the bot with `token`. Other fields of the
+    # message may be given as keyword arguments. Returns the update.
+    def message(self, token, chat_id, text=None, **fields):
+        bot = self._bot(token)
+        with bot.lock:
+            message_id = bot.next_message_id
+            bot.next_message_id += 1
+
+        msg = {'message_id': message_id,
+               'from': {'id': chat_id, 'first_name': 'User%d' % abs(chat_id)},
+               'chat': {'id': chat_id, 'type': 'private' if chat_id > 0 else 'group'},
+               'date': int(time.time()),}
+        if text is not None:
+            msg['text'] = text
+        msg.update(fields)
+
+        return self.push(token, msg)
+
+    # Calls of send methods made by the bot with `token`, as (method, parameters)
+    def sent(self, token):
+        bot = self._bot(token)
+        with bot.lock:
+            return list(bot.sent)
+
+    # Number of calls, per method
+    def calls(self):
+        with self._lock:
+            return dict(self._calls)
+
+    # Make the next `count` calls to `method` (any method if None) fail.
+    def inject(self, method=None, error_code=500, description='Internal Server Error', retry_after=None, count=1):
+        parameters = {'retry_after': retry_after} if retry_after is not None else None
+        with self._lock:
+            self._injected.append([method, count, _Failure(error_code, description, parameters)])
+
+    def _injected_failure(self, method):
+        with self._lock:
+            for entry in self._injected:
+                if entry[0] in (None, method):
+                    entry[1] -= 1
+                    if entry[1] <= 0:
+                        self._injected.remove(entry)
+                    return entry[2]
+        return None
+
+    def _delay(self):
+        latency = self.latency
+        if isinstance(latency, tuple):
+            latency = random.uniform(*latency)
+        if latency > 0:
+            time.sleep(latency)
+
+    # Returns the result of `method`, or raises `_Failure`.
+    def call(self, token, method, params, files):
+        with self._lock:
+            self._calls[method] += 1
+
+        self._delay()
+
+        failure = self._injected_failure(method)
+        if failure:
+            raise failure
+
+        if self.error_rate and random.random() < self.error_rate:
+            raise _Failure(500, 'Internal Server Error')
+
+        bot = self._bot(token)
+        handler = getattr(self, '_' + method, None)
+        if handler is not None:
+            return handler(bot, params, files)
+        elif method in _SEND_METHODS:
+            return self._send(bot, method, params, files)
+        else:
+            raise _Failure(404, 'Not Found: method not found')
+
+    def _getMe(self, bot, params, files):
+        return {'id': bot.id, 'first_name': 'FakeBot%d' % bot.id, 'username': 'fake%d_bot' % bot.id}
+
+    def _getUpdates(self, bot, params, files):
+        offset = int(params.get('offset', 0))
+        limit = min(100, int(params.get('limit', 100)))
+        timeout = float(params.get('timeout', 0))
+        deadline = time.time() + timeout
+
+        with bot.lock:
+            if bot.webhook:
+                raise _Failure(409, "Conflict: can't use getUpdates method while webhook is active")
+
+            # Updates below the offset are confirmed.
+            while bot.updates and bot.updates[0]['update_id'] < offset:
+                bot.updates.popleft()
+
+            while not bot.updates and self._running:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    break
+                bot.lock.wait(remaining)
+
+            return list(bot.updates)[:limit]
+
+    def _setWebhook(self, bot, params, files):
+        with bot.lock:
+            bot.webhook = params.get('url') or None
+            if bot.webhook and not (bot.webhook_thread and bot.webhook_thread.is_alive()):
+                bot.webhook_thread = threading.Thread(target=self._deliver, args=(bot,))
+                bot.webhook_thread.daemon = True
+                bot.webhook_thread.start()
+            bot.lock.notify_all()
+        return True
+
+    # Post updates to the webhook, one at a time, in order, retrying each until it is accepted.
+    def _deliver(self, bot):
+        # The webhook may well use a self-signed certificate.
+        context = ssl._create_unverified_context() if hasattr(ssl, '_create_unverified_context') else None
+        failures = 0
+
+        while self._running:
+            with bot.lock:
+                while self._running and bot.webhook and not bot.updates:
+                    bot.lock.wait(1)
+
+                if not self._running or not bot.webhook:
+                    return
+
+                url, update = bot.webhook, bot.updates[0]
+
+            try:
+                request = Request(url, self.codec.dumps(update).encode('utf-8'), {'Content-Type': 'application/json'})
+                urlopen(request, timeout=10, **({'context': context} if context else {})).close()
+            except Exception:
+                failures += 1
+                time.sleep(min(0.1 * 2 ** failures, 5))
+                continue
+
+            failures = 0
+            with bot.lock:
+                if bot.updates and bot.updates[0] is update:
+                    bot.updates.popleft()
+
+    def _sendChatAction(self, bot, params, files):
+        with bot.lock:
+            bot.sent.append(('sendChatAction', params))
+        return True
+
+    def _check_limit(self, bot, chat_id):
+        if not self.chat_limit:
+            return
+
+        now = time.time()
+        with bot.lock:
+            b = bot.buckets.get(chat_id)
+            if b is None:
+                b = bot.buckets[chat_id] = telepot.ratelimit.TokenBucket(*self.chat_limit)
+
+            t = b.earliest(now)
+            if t > now:
+                retry_after = int(t - now) + 1
+                raise _Failure(429, 'Too Many Requests: retry after %d' % retry_after, {'retry_after': retry_after})
+            b.consume(now)
+
+    def _store(self, filename, content):
+        with self._lock:
+            file_id = 'file%d' % (len(self._files) + 1)
+            self._files[file_id] = content
+        return file_id
+
+    def _send(self, bot, method, params, files):
+        try:
+            chat_id = int(params['chat_id'])
+        except KeyError:
+            raise _Failure(400, 'Bad Request: chat_id is empty')
+        except ValueError:
+            chat_id = params['chat_id']
+
+        self._check_limit(bot, chat_id)
+
+        with bot.lock:
+            message_id = bot.next_message_id
+            bot.next_message_id += 1
+            bot.sent.append((method, params))
+
+        msg = {'message_id': message_id,
+               'from': self._getMe(bot, params, files),
+               'chat': {'id': chat_id},
+               'date': int(time.time()),}
+
+        field = _SEND_METHODS[method]
+        if method == 'sendMessage':
+            msg['text'] = params.get('text', '')
+        elif method == 'sendLocation':
+            msg['location'] = {'latitude': float(params['latitude']), 'longitude': float(params['longitude'])}
+        elif field:
+            if field in files:
+                filename, content = files[field]
+                file_id = self._store(filename, content)
+            else:
+                file_id = params.get(field)
+                with self._lock:
+                    if file_id not in self._files:
+                        raise _Failure(400, 'Bad Request: wrong file identifier/HTTP URL specified')
+                    content = self._files[file_id]
+
+            f = {'file_id': file_id, 'file_size': len(content)}
+            msg[field] = [dict(f, width=1, height=1)] if field == 'photo' else f
+
+        return msg
+
+    def _getFile(self, bot, params, files):
+        file_id = params.get('file_id')
+        with self._lock:
+            if file_id not in self._files:
+                raise _Failure(400, 'Bad Request: wrong file_id specified')
+            size = len(self._files[file_id])
+        return {'file_id': file_id, 'file_size': size, 'file_path': 'files/%s' % file_id}
+
+    # Content of a file downloaded at `path`, or None
+    def file_content(self, path):
+        file_id = path.rsplit('/', 1)[-1]
+        with self._lock:
+            return self._files.get(file_id)
+
+    # Add a file, as if someone had sent it to a bot. Returns its file id.
+    def add_file(self, content, filename='file'):
+        return self._store(filename, content)
+
+
+def _make_handler(server):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def log_message(self, format, *args):
+            pass
+
+        def setup(self):
+            BaseHTTPRequestHandler.setup(self)
+            with self.server.lock:
+                self.server.connections[self.connection] = threading.current_thread()
+
+        def finish(self):
+            with self.server.lock:
+                self.server.connections.pop(self.connection, None)
+            BaseHTTPRequestHandler.finish(self)
+
+        def _read_body(self):
+            if self.headers.get('Transfer-Encoding', '').lower() == 'chunked':
+                chunks = []
+                while 1:
+                    size = int(self.rfile.readline().split(b';')[0], 16)
+                    if size == 0:
+                        self.rfile.readline()
+                        return b''.join(chunks)
+                    chunks.append(self.rfile.read(size))
+                    self.rfile.readline()
+
+            length = int(self.headers.get('Content-Length') or 0)
+            return self.rfile.read(length) if length else b''
+
+        def _params(self, query, body):
+            params, files = _form(query), {}
+            content_type = self.headers.get('Content-Type', '')
+
+            if content_type.startswith('multipart/form-data'):
+                fields, files = _multipart(body, content_type)
+                params.update(fields)
+            elif content_type.startswith('application/json'):
+                params.update(server.codec.loads(body))
+            elif body:
+                params.update(_form(body))
+
+            return params, files
+
+        def _respond(self, status, body, content_type='application/json', headers=()):
+            self.send_response(status)
+            self.send_header('Content-Type', content_type)
+            self.send_header('Content-Length', str(len(body)))
+            for name, value in headers:
+                self.send_header(name, value)
+            self.end_headers()
+            if self.command != 'HEAD':
+                self.wfile.write(body)
+
+        def _json(self, status, obj):
+            self._respond(status, server.codec.dumps(obj).encode('utf-8'))
+
+        def _download(self, path):
+            content = server.file_content(path)
+            if content is None:
+                return self._json(404, {'ok': False, 'error_code': 404, 'description': 'Not Found'})
+
+            # Serve the Range requests resumed and parallel downloads make.
+            m = re.match(r'bytes=(\d+)-(\d*)$', self.headers.get('Range', ''))
+            if m:
+                start = int(m.group(1))
+                end = int(m.group(2)) + 1 if m.group(2) else len(content)
+                self._respond(206, content[start:end], 'application/octet-stream',
+                              [('Content-Range', 'bytes %d-%d/%d' % (start, end - 1, len(content)))])
+            else:
+                self._respond(200, content, 'application/octet-stream')
+
+        def _serve(self):
+            url = urlparse(self.path)
+            m = _PATH.match(url.path)
+            body = self._read_body()
+
+            if not m:
+                return self._json(404, {'ok': False, 'error_code': 404, 'description': 'Not Found'})
+
+            is_file, token, method = m.groups()
+            if is_file:
+                return self._download(method)
+
+            try:
+                params, files = self._params(url.query, body)
+                result = server.call(token, method, params, files)
+            except _Failure as e:
+                response = {'ok': False, 'error_code': e.error_code, 'description': e.description}
+                if e.parameters:
+                    response['parameters'] = e.parameters
+                return self._json(e.error_code, response)
+            except Exception:
+                traceback.print_exc()
+                return self._json(500, {'ok': False, 'error_code': 500, 'description': 'Internal Server Error'})
+
+            self._json(200, {'ok': True, 'result': result})
+
+        do_GET = do_POST = do_HEAD = _serve
+
+    return Handler
@@ -1,7 +1,10 @@
 import time
+import pickle
+import tempfile
 import traceback
 import threading
 import logging
+import collections
 import telepot
 import telepot.filtering
 from functools import partial
@@ -12,6 +15,123 @@ except ImportError:
     import queue
 
 
+# What a full `ListenerQueue` does with another message
+BLOCK = 'block'              # wait for room
+DROP_OLDEST = 'drop-oldest'  # make room by dropping the oldest message
+DROP_NEWEST = 'drop-newest'  # drop the new message
+SPILL = 'spill'              # keep the new message on disk until there is room
+
+_OVERFLOWS = (BLOCK, DROP_OLDEST, DROP_NEWEST, SPILL)
+
+
+# Storage behind a `ListenerQueue`, used in place of the deque of `queue.Queue` and
+# `asyncio.Queue`. Keeps at most `maxsize` messages in memory (no limit if 0), and deals
+# with more according to `overflow`. Spilled messages are pickled to a temporary file
+# in `spill_dir`, and read back in order.
+class _Buffer(object):
+    def __init__(self, maxsize, overflow, spill_dir=None):
+        self._maxsize = maxsize
+        self._overflow = overflow
+        self._spill_dir = spill_dir
+        self._memory = collections.deque()
+
+        self._file = None
+        self._on_disk = 0
+        self._read_pos = 0
+        self._write_pos = 0
+
+        self.peak = 0
+        self.dropped = 0
+        self.spilled = 0
+
+    def __len__(self):
+        return len(self._memory) + self._on_disk
+
+    def _full(self):
+        return self._maxsize > 0 and len(self._memory) >= self._maxsize
+
+    def append(self, msg):
+        if self._full() or self._on_disk:
+            if self._overflow == DROP_OLDEST:
+                self._memory.popleft()
+                self.dropped += 1
+            elif self._overflow == DROP_NEWEST:
+                self.dropped += 1
+                return
+            elif self._overflow == SPILL:
+                self._spill(msg)
+                self.peak = max(self.peak, len(self))
+                return
+
+        self._memory.append(msg)
+        self.peak = max(self.peak, len(self))
+
+    def _spill(self, msg):
+        if self._file is None:
+            self._file = tempfile.TemporaryFile(dir=self._spill_dir)
+
+        self._file.seek(self._write_pos)
+        pickle.dump(msg, self._file, 2)
+        self._write_pos = self._file.tell()
+        self._on_disk += 1
+        self.spilled += 1
+
+    def _unspill(self):
+        self._file.seek(self._read_pos)
+        msg = pickle.load(self._file)
+        self._read_pos = self._file.tell()
+        self._on_disk -= 1
+
+        # Reuse the file from the start once it is read through.
+        if not self._on_disk:
+            self._file.seek(0)
+            self._file.truncate()
+            self._read_pos = self._write_pos = 0
+
+        return msg
+
+    def popleft(self):
+        msg = self._memory.popleft()
+
+        # Bring back spilled messages as room is made, so they stay in order.
+        if self._on_disk and not self._full():
+            self._memory.append(self._unspill())
+
+        return msg
+
+    def stats(self):
+        return {'depth': len(self),
+                'on_disk': self._on_disk,
+                'peak': self.peak,
+                'dropped': self.dropped,
+                'spilled': self.spilled,}
+
+
+# A listener's message queue holding at most `maxsize` messages (no limit if 0). When it is
+# full, another message is dealt with according to `overflow`: BLOCK, DROP_OLDEST,
+# DROP_NEWEST or SPILL (to a temporary file in `spill_dir`).
+class ListenerQueue(queue.Queue):
+    def __init__(self, maxsize=0, overflow=DROP_OLDEST, spill_dir=None):
+        if overflow not in _OVERFLOWS:
+            raise ValueError('Unknown overflow policy: %s' % overflow)
+
+        self.overflow = overflow
+        self._limit = maxsize
+        self._spill_dir = spill_dir
+
+        # Only blocking is left to the queue. Otherwise, it takes every message, and the
+        # buffer decides what to keep.
+        queue.Queue.__init__(self, maxsize if overflow == BLOCK else 0)
+
+    def _init(self, maxsize):
+        self.queue = _Buffer(0 if self.overflow == BLOCK else self._limit, self.overflow, self._spill_dir)
+
+    # Depth, peak depth, messages dropped and spilled to disk
+    def stats(self):
+        with self.mutex:
+            return self.queue.stats()
+
+
 class Microphone(object):
     def __init__(self):
         self._queues = set()
@@ -31,13 +151,24 @@ class Microphone(object):
     def remove(self, q):
         self._queues.remove(q)
 
-    @_locked
     def send(self, msg):
-        for q in self._queues:
-            try:
-                q.put_nowait(msg)
-            except queue.Full:
-                traceback.print_exc()
+        with self._lock:
+            queues = list(self._queues)
+
+        for q in queues:
+            if getattr(q, 'overflow', None) == BLOCK:
+                # Wait for room, unless the listener goes away meanwhile.
+                while q in self._queues:
+                    try:
+                        q.put(msg, timeout=1)
+                        break
+                    except queue.Full:
+                        pass
+            else:
+                try:
+                    q.put_nowait(msg)
+                except queue.Full:
+                    traceback.print_exc()
 
 
 class WaitTooLong(telepot.TelepotException):
@@ -64,6 +195,14 @@ class Listener(object):
     def get_options(self, *names):
         return tuple(map(lambda n: self._options[n], names))
 
+    # Depth of the message queue and, for a `ListenerQueue`, its peak depth and the number
+    # of messages dropped and spilled to disk
+    def stats(self):
+        if hasattr(self._queue, 'stats'):
+            return self._queue.stats()
+        else:
+            return {'depth': self._queue.qsize()}
+
     def capture(self, **criteria):
         self._criteria.append(criteria)
 
@@ -0,0 +1,189 @@
+import time
+import threading
+import traceback
+import collections
+import telepot
+import telepot.offset
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+
+class _Entry(object):
+    def __init__(self, bot, handler, tracker, maxsize):
+        self.bot = bot
+        self.handler = handler
+        self.tracker = tracker
+        self.queue = queue.Queue(maxsize)
+        self.scheduled = False  # whether it is in the ready queue
+        self.removed = False
+
+
+# Polls many bots in one process, and hands their updates to `workers` threads shared by
+# all bots. Each bot long-polls on a thread of its own, and keeps at most `maxsize` updates
+# waiting. Workers take turns among bots with updates waiting, one update at a time, so a
+# busy bot cannot hold up quiet ones. A busy bot whose updates pile up stops polling until
+# workers catch up.
+#
+# Bots should be created with `session=mux.session`, to share its connection pool. Every
+# bot keeps a connection open to long-poll, so the pool should hold at least as many
+# connections as there are bots, plus some for sending.
+class Multiplexer(object):
+    def __init__(self, session=None, workers=8, maxsize=100, relax=0.1, timeout=20):
+        if session is None:
+            self.session = telepot.create_session(pool_maxsize=100)
+            self._own_session = True
+        else:
+            self.session = session
+            self._own_session = False
+
+        self._workers = workers
+        self._maxsize = maxsize
+        self._relax = relax
+        self._timeout = timeout
+
+        self._lock = threading.Lock()
+        self._entries = collections.OrderedDict()
+        self._ready = collections.deque()  # bots with updates waiting, in turn
+        self._pending = threading.Semaphore(0)  # counts updates waiting
+        self._running = False
+
+    @property
+    def bots(self):
+        with self._lock:
+            return list(self._entries)
+
+    # Start polling `bot`, passing its messages to `handler`, `bot.handle` by default.
+    # A `DelegatorBot` thus routes its own messages. `offset_store` works as in `notifyOnMessage()`.
+    def add(self, bot, handler=None, offset_store=None):
+        with self._lock:
+            if bot in self._entries:
+                raise ValueError('Bot already added')
+
+            e = _Entry(bot, handler if handler is not None else bot.handle, telepot.offset.OffsetTracker(offset_store), self._maxsize)
+            self._entries[bot] = e
+
+            if self._running:
+                self._spawn(self._poll, e)
+
+    # Stop polling `bot`, once its current `getUpdates()` returns. Updates already fetched
+    # are still handled.
+    def remove(self, bot):
+        with self._lock:
+            self._entries.pop(bot).removed = True
+
+    # Number of updates waiting, per bot
+    def qsize(self):
+        with self._lock:
+            return dict([(bot, e.queue.qsize()) for bot, e in self._entries.items()])
+
+    def _spawn(self, target, *args):
+        t = threading.Thread(target=target, args=args)
+        t.daemon = True
+        t.start()
+
+    # Wait for room in the bot's queue, checking once a second that polling goes on, so
+    # `stop()` and `remove()` are not held up by a full queue. Returns False if it does not.
+    def _put(self, e, u):
+        while self._running and not e.removed:
+            try:
+                e.queue.put(u, timeout=1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    # Queue an update, and line the bot up for workers. Returns False if polling stops first.
+    def _enqueue(self, e, u):
+        if not self._put(e, u):
+            return False
+
+        with self._lock:
+            if not e.scheduled:
+                e.scheduled = True
+                self._ready.append(e)
+
+        self._pending.release()
+        return True
+
+    def _poll(self, e):
+        # Updates fetched before a restart, but not handled, go first.
+        for u in e.tracker.recover():
+            if not self._enqueue(e, u):
+                return
+
+        backlog = False
+        while self._running and not e.removed:
+            try:
+                # As in `notifyOnMessage()`
+                limit = max(25, min(100, self._maxsize - e.queue.qsize())) if self._maxsize > 0 else 100
+                result = e.bot.getUpdates(offset=e.tracker.offset, limit=limit, timeout=0 if backlog else self._timeout)
+
+                fresh = e.tracker.accept(result)
+
+                for u in fresh:
+                    if not self._enqueue(e, u):
+                        return
+
+                backlog = len(fresh) > 0 and len(result) >= limit
+            except:
+                # Closing the session on `stop()` breaks off polls in progress.
+                if not self._running:
+                    return
+
+                traceback.print_exc()
+                backlog = False
+                time.sleep(self._relax)
+            else:
+                # Relax only when there is nothing to do.
+                if not fresh:
+                    time.sleep(self._relax)
+
+    def _work(self):
+        while 1:
+            self._pending.acquire()
+            if not self._running:
+                return
+
+            # Take one update from the bot whose turn it is. If it has more, it goes to
+            # the back of the line.
+            with self._lock:
+                e = self._ready.popleft()
+                u = e.queue.get_nowait()
+                if e.queue.empty():
+                    e.scheduled = False
+                else:
+                    self._ready.append(e)
+
+            try:
+                e.handler(u['message'])
+            except:
+                # Localize the error so worker thread can keep going.
+                traceback.print_exc()
+            finally:
+                e.tracker.done(u['update_id'])
+
+    # Poll all bots, and keep polling bots added later.
+    def start(self):
+        with self._lock:
+            self._running = True
+
+            for i in range(self._workers):
+                self._spawn(self._work)
+
+            for e in self._entries.values():
+                self._spawn(self._poll, e)
+
+    # Stop polling and handling. Updates being handled are finished, those waiting are left
+    # to be fetched again, if bots have offset stores.
+    def stop(self):
+        with self._lock:
+            self._running = False
+
+        for i in range(self._workers):
+            self._pending.release()
+
+        if self._own_session:
+            self.session.close()
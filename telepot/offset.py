@@ -0,0 +1,167 @@
+import os
+import time
+import sqlite3
+import threading
+import collections
+import telepot.codec
+
+# Rename, overwriting `dest` if it exists
+_replace = getattr(os, 'replace', os.rename)
+
+
+# A store keeps the state of an `OffsetTracker`: the offset to poll from, and updates fetched
+# but not yet handled. It needs two methods:
+#   - load(): returns (offset, updates), or None if nothing has been saved
+#   - save(offset, updates)
+
+
+# Keeps the state in a file, as JSON. It is written to a temporary file and renamed, so a crash
+# never leaves a half-written state.
+class FileOffsetStore(object):
+    def __init__(self, path, codec=None):
+        self._path = path
+        self._codec = codec if codec is not None else telepot.codec.get()
+
+    def load(self):
+        try:
+            with open(self._path, 'rb') as f:
+                state = self._codec.loads(f.read())
+        except (IOError, OSError, ValueError):
+            return None
+        return state['offset'], state['updates']
+
+    def save(self, offset, updates):
+        tmp = self._path + '.tmp'
+        with open(tmp, 'wb') as f:
+            f.write(self._codec.dumps({'offset': offset, 'updates': updates}).encode('utf-8'))
+            # Make sure the content is on disk before the rename, or a power loss may
+            # leave an empty file in place of the old one.
+            f.flush()
+            os.fsync(f.fileno())
+        _replace(tmp, self._path)
+
+
+# Keeps states in an SQLite database, under `name`, so several bots may share one database.
+class SQLiteOffsetStore(object):
+    def __init__(self, path, name='default', codec=None):
+        self._name = name
+        self._codec = codec if codec is not None else telepot.codec.get()
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute('CREATE TABLE IF NOT EXISTS offsets (name TEXT PRIMARY KEY, offset INTEGER NOT NULL, updates TEXT NOT NULL)')
+        self._db.commit()
+
+    def load(self):
+        with self._lock:
+            row = self._db.execute('SELECT offset, updates FROM offsets WHERE name = ?', (self._name,)).fetchone()
+        return (row[0], self._codec.loads(row[1])) if row else None
+
+    def save(self, offset, updates):
+        with self._lock:
+            self._db.execute('INSERT OR REPLACE INTO offsets (name, offset, updates) VALUES (?, ?, ?)', (self._name, offset, self._codec.dumps(updates)))
+            self._db.commit()
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+
+# Keeps track of updates fetched and handled.
+#
+# Updates whose id has been seen recently (among the last `window`) are rejected, so an
+# update delivered twice is handled once. Polling goes on past the highest update fetched,
+# so a slow handler never holds up the rest.
+#
+# Telegram forgets updates as soon as a higher offset is polled, whether they have been
+# handled or not. So, if a `store` is given, every batch accepted is saved there, along with
+# the other updates not yet handled, before the next poll. After a restart, `recover()`
+# returns those updates, to be handled again, and polling resumes where it left off. As
+# updates are handled, they are dropped from the store, at most every `interval` seconds
+# and whenever all updates are handled.
+class OffsetTracker(object):
+    def __init__(self, store=None, window=1000, interval=1.0):
+        self.store = store
+        self._interval = interval
+        self._lock = threading.Lock()
+        self._pending = {}  # id => update fetched, but not yet handled
+        self._seen = set()
+        self._order = collections.deque()
+        self._window = window
+        self._high = None  # highest update id seen
+        self._floor = None  # updates below this were fetched before a restart
+        self._recovered = []
+        self._saved_at = 0
+
+        state = store.load() if store else None
+        if state is not None:
+            offset, updates = state
+            self._high = self._floor = offset - 1
+            for u in updates:
+                self._see(u['update_id'])
+                self._pending[u['update_id']] = u
+            self._recovered = sorted(updates, key=lambda u: u['update_id'])
+
+    # Offset to call `getUpdates()` with
+    @property
+    def offset(self):
+        with self._lock:
+            return self._high + 1 if self._high is not None else None
+
+    def _see(self, update_id):
+        self._seen.add(update_id)
+        self._order.append(update_id)
+        if len(self._order) > self._window:
+            self._seen.discard(self._order.popleft())
+
+    # Updates fetched before a restart, but not handled. Returned once, to be handled first.
+    def recover(self):
+        with self._lock:
+            recovered, self._recovered = self._recovered, []
+            return recovered
+
+    # Returns the updates of a batch not seen before, to be handled. With a store, they are
+    # saved before returning, so they are not lost once the next poll makes Telegram forget them.
+    def accept(self, updates):
+        with self._lock:
+            fresh = []
+            for u in updates:
+                update_id = u['update_id']
+                if update_id in self._seen:
+                    continue
+
+                if self._floor is not None and update_id <= self._floor:
+                    continue
+
+                self._see(update_id)
+                if self._high is None or update_id > self._high:
+                    self._high = update_id
+
+                if self.store is not None:
+                    self._pending[update_id] = u
+                fresh.append(u)
+
+            if fresh and self.store is not None:
+                self._save()
+
+            return fresh
+
+    def _save(self):
+        self._saved_at = time.time()
+        self.store.save(self._high + 1, sorted(self._pending.values(), key=lambda u: u['update_id']))
+
+    # Mark an update as handled
+    def done(self, update_id):
+        with self._lock:
+            if self._pending.pop(update_id, None) is None or self.store is None:
+                return
+
+            if self._pending and time.time() - self._saved_at < self._interval:
+                return
+
+            self._save()
+
+    # Save the state now
+    def flush(self):
+        with self._lock:
+            if self.store is not None and self._high is not None:
+                self._save()
@@ -0,0 +1,133 @@
+import time
+import itertools
+import traceback
+import multiprocessing
+import multiprocessing.managers
+import telepot.ratelimit
+import telepot.executor
+
+
+class _Manager(multiprocessing.managers.BaseManager):
+    pass
+
+_Manager.register('Scheduler', telepot.ratelimit.Scheduler, exposed=('reserve', '_release', 'stats'))
+
+
+# Stands in for a `telepot.ratelimit.Scheduler` kept in another process, so bots in several
+# processes share the same limits. Only the reservation goes across. Waiting is done here.
+class SchedulerClient(object):
+    def __init__(self, proxy):
+        self._proxy = proxy
+
+    def reserve(self, chat_id):
+        return self._proxy.reserve(chat_id)
+
+    def acquire(self, chat_id):
+        delay = self._proxy.reserve(chat_id)
+        if delay > 0:
+            try:
+                time.sleep(delay)
+            finally:
+                self._proxy._release()
+
+    def stats(self):
+        return self._proxy.stats()
+
+
+# Body of a worker process
+def _work(factory, scheduler, queue):
+    bot = factory(SchedulerClient(scheduler) if scheduler is not None else None)
+
+    while 1:
+        msg = queue.get()
+        if msg is None:
+            return
+
+        try:
+            bot.handle(msg)
+        except:
+            # Localize the error so the worker can keep going.
+            traceback.print_exc()
+
+
+# Hands messages to `processes` worker processes. Messages of the same chat always go to
+# the same process, so a `DelegatorBot` there keeps each conversation's state to itself.
+# At most `maxsize` messages wait for each process; beyond that, `put()` blocks.
+#
+# Each process creates its bot by calling `factory(scheduler)`, and passes messages to
+# `bot.handle()`. Unless `share_limits` is False, `scheduler` stands in for a
+# `telepot.ratelimit.Scheduler` kept by the pool, so bots in all processes together stay
+# within Telegram's flood limits, or those given by `limits`, a dict of arguments to `Scheduler`.
+# Otherwise, it is None. Where processes are spawned rather
+# than forked, `factory` must be picklable, e.g. a module-level function or a `functools.partial()`.
+class WorkerPool(object):
+    def __init__(self, factory, processes=None, maxsize=1000, share_limits=True, limits=None):
+        self._factory = factory
+        self._processes = processes if processes is not None else multiprocessing.cpu_count()
+        self._maxsize = maxsize
+        self._share_limits = share_limits
+        self._limits = limits or {}
+
+        self._manager = None
+        self._scheduler = None
+        self._queues = []
+        self._workers = []
+        self._counter = itertools.count()
+
+    @property
+    def processes(self):
+        return self._processes
+
+    # Shared `Scheduler`, for bots in this process to use too, or None
+    @property
+    def scheduler(self):
+        return SchedulerClient(self._scheduler) if self._scheduler is not None else None
+
+    def start(self):
+        if self._share_limits:
+            self._manager = _Manager()
+            self._manager.start()
+            self._scheduler = self._manager.Scheduler(**self._limits)
+
+        for i in range(self._processes):
+            q = multiprocessing.Queue(self._maxsize)
+            p = multiprocessing.Process(target=_work, args=(self._factory, self._scheduler, q))
+            p.daemon = True
+            p.start()
+
+            self._queues.append(q)
+            self._workers.append(p)
+
+    # Index of the process that handles `msg`
+    def worker_of(self, msg):
+        key = telepot.executor.chat_key(msg)
+        if key is None:
+            return next(self._counter) % self._processes
+        else:
+            return hash(key) % self._processes
+
+    # Pass `msg` to its process. Give this as the callback to `notifyOnMessage()` or
+    # `notifyOnWebhook()`.
+    def put(self, msg):
+        self._queues[self.worker_of(msg)].put(msg)
+
+    # Let processes finish the messages queued, waiting up to `timeout` seconds for them
+    # to exit, then terminate the rest.
+    def stop(self, timeout=None):
+        for q in self._queues:
+            q.put(None)
+
+        deadline = time.time() + timeout if timeout is not None else None
+        for p in self._workers:
+            p.join(max(0, deadline - time.time()) if deadline is not None else None)
+            if p.is_alive():
+                p.terminate()
+
+        for q in self._queues:
+            q.close()
+
+        if self._manager:
+            self._manager.shutdown()
+
+        self._queues, self._workers = [], []
+        self._manager = self._scheduler = None
@@ -0,0 +1,154 @@
+import time
+import threading
+
+try:
+    _clock = time.monotonic
+except AttributeError:
+    _clock = time.time
+
+
+# Methods that produce a message in a chat, hence subject to Telegram's flood limits.
+SEND_METHODS = frozenset(['sendMessage',
+                          'forwardMessage',
+                          'sendPhoto',
+                          'sendAudio',
+                          'sendDocument',
+                          'sendSticker',
+                          'sendVideo',
+                          'sendVoice',
+                          'sendLocation',])
+
+
+def is_group(chat_id):
+    # Groups have negative ids. Channels may be addressed by '@username'.
+    try:
+        return int(chat_id) < 0
+    except (TypeError, ValueError):
+        return True
+
+
+class TokenBucket(object):
+    def __init__(self, rate, capacity=1):
+        self.rate = float(rate)          # tokens per second
+        self.capacity = float(capacity)  # burst size
+        self._tokens = self.capacity
+        self._stamp = None
+
+    def level(self, t):
+        if self._stamp is None:
+            return self.capacity
+
+        # `t` may be earlier than `_stamp` if a token has been reserved for the future.
+        return min(self.capacity, self._tokens + (t - self._stamp) * self.rate)
+
+    # Earliest time, not before `t`, when a token is available
+    def earliest(self, t):
+        level = self.level(t)
+        if level >= 1:
+            return t
+        else:
+            return t + (1 - level) / self.rate
+
+    def consume(self, t):
+        self._tokens = self.level(t) - 1
+        self._stamp = t
+
+
+# Reserves a slot for every outgoing message, so that the bot stays within:
+#   - global_limit: about 30 messages per second overall
+#   - chat_limit: about 1 message per second to the same chat
+#   - group_limit: about 20 messages per minute to the same group
+# Each limit is a tuple of (rate per second, burst), or None to disable it.
+#
+# Callers are never refused. A caller whose slot lies in the future just waits until then,
+# so concurrent senders are served in the order they ask, at the fastest allowed rate.
+class Scheduler(object):
+    def __init__(self, global_limit=(30, 30), chat_limit=(1, 1), group_limit=(20/60.0, 20)):
+        self._lock = threading.Lock()
+        self._global = TokenBucket(*global_limit) if global_limit else None
+        self._chat_limit = chat_limit
+        self._group_limit = group_limit
+        self._chats = {}
+        self._groups = {}
+        self._last_prune = _clock()
+
+        self._waiting = 0
+        self._peak_waiting = 0
+        self._count = 0
+        self._delayed = 0
+        self._total_wait = 0.0
+        self._max_wait = 0.0
+
+    def _bucket(self, buckets, chat_id, limit):
+        try:
+            return buckets[chat_id]
+        except KeyError:
+            b = buckets[chat_id] = TokenBucket(*limit)
+            return b
+
+    def _buckets(self, chat_id):
+        bs = []
+        if self._global:
+            bs.append(self._global)
+        if self._chat_limit:
+            bs.append(self._bucket(self._chats, chat_id, self._chat_limit))
+        if self._group_limit and is_group(chat_id):
+            bs.append(self._bucket(self._groups, chat_id, self._group_limit))
+        return bs
+
+    # Forget buckets that have refilled. They would be recreated identical.
+    def _prune(self, now):
+        if now - self._last_prune < 1:
+            return
+
+        for buckets in [self._chats, self._groups]:
+            for chat_id in [k for k,b in buckets.items() if b.level(now) >= b.capacity]:
+                del buckets[chat_id]
+
+        self._last_prune = now
+
+    # Reserve a slot for a message to `chat_id`. Returns how many seconds the caller
+    # should wait before sending. If positive, the caller must call `_release()` after waiting.
+    def reserve(self, chat_id):
+        with self._lock:
+            now = _clock()
+            buckets = self._buckets(chat_id)
+
+            t = max([b.earliest(now) for b in buckets]) if buckets else now
+            for b in buckets:
+                b.consume(t)
+
+            self._prune(now)
+
+            delay = t - now
+            self._count += 1
+            if delay > 0:
+                self._delayed += 1
+                self._total_wait += delay
+                self._max_wait = max(self._max_wait, delay)
+                self._waiting += 1
+                self._peak_waiting = max(self._peak_waiting, self._waiting)
+
+            return delay
+
+    def _release(self):
+        with self._lock:
+            self._waiting -= 1
+
+    def acquire(self, chat_id):
+        delay = self.reserve(chat_id)
+        if delay > 0:
+            try:
+                time.sleep(delay)
+            finally:
+                self._release()
+
+    def stats(self):
+        with self._lock:
+            return {'queued': self._waiting,
+                    'peak_queued': self._peak_waiting,
+                    'scheduled': self._count,
+                    'delayed': self._delayed,
+                    'total_wait': self._total_wait,
+                    'max_wait': self._max_wait,
+                    'average_wait': self._total_wait / self._count if self._count else 0.0,}
@@ -0,0 +1,109 @@
+import io
+import time
+import gzip
+import threading
+import traceback
+import telepot.codec
+
+
+def _open(path, mode):
+    if path.endswith('.gz'):
+        return gzip.open(path, mode)
+    else:
+        return io.open(path, mode)
+
+
+# Appends updates to `path`, one JSON line each: [time received, update]. The file is
+# gzip-compressed if its name ends with `.gz`. Several threads may write at once.
+class Recorder(object):
+    def __init__(self, path, codec=None):
+        self._codec = codec if codec is not None else telepot.codec.get()
+        self._lock = threading.Lock()
+        self._file = _open(path, 'ab')
+        self.count = 0
+
+    def write(self, update):
+        line = (self._codec.dumps([round(time.time(), 3), update]) + '\n').encode('utf-8')
+        with self._lock:
+            self._file.write(line)
+            self.count += 1
+
+    def flush(self):
+        with self._lock:
+            self._file.flush()
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+# Yields (time received, update) from a file written by `Recorder`.
+def read(path, codec=None):
+    codec = codec if codec is not None else telepot.codec.get()
+    with _open(path, 'rb') as f:
+        for line in f:
+            if line.strip():
+                t, update = codec.loads(line)
+                yield t, update
+
+
+# Yields updates from `records`, at the pace they were received, `speed` times faster.
+# A `speed` of None means as fast as possible.
+def paced(records, speed=1.0):
+    start = t0 = None
+    for t, update in records:
+        if speed:
+            if t0 is None:
+                start, t0 = time.time(), t
+            else:
+                delay = start + (t - t0) / speed - time.time()
+                if delay > 0:
+                    time.sleep(delay)
+        yield update
+
+
+def _percentile(ordered, p):
+    return ordered[min(len(ordered) - 1, int(len(ordered) * p))]
+
+# Summary of a replay: number of updates, handler errors, seconds taken, updates per second,
+# and handler latency in seconds.
+def report(latencies, elapsed, errors=0):
+    ordered = sorted(latencies)
+    n = len(ordered)
+    return {'count': n,
+            'errors': errors,
+            'elapsed': elapsed,
+            'throughput': n / elapsed if elapsed > 0 else 0.0,
+            'latency': {'mean': sum(ordered) / n if n else 0.0,
+                        'p50': _percentile(ordered, 0.5) if n else 0.0,
+                        'p90': _percentile(ordered, 0.9) if n else 0.0,
+                        'p99': _percentile(ordered, 0.99) if n else 0.0,
+                        'max': ordered[-1] if n else 0.0,},}
+
+
+# Feeds the messages recorded in `path` to `handler`, e.g. `bot.handle`, one after another,
+# at the pace they were received, `speed` times faster, or as fast as possible if `speed` is None.
+# Returns a `report()` of how long `handler` took.
+def replay(path, handler, speed=1.0, codec=None):
+    latencies, errors = [], 0
+    start = time.time()
+
+    for update in paced(read(path, codec), speed):
+        if 'message' not in update:
+            continue
+
+        t = time.time()
+        try:
+            handler(update['message'])
+        except:
+            traceback.print_exc()
+            errors += 1
+        latencies.append(time.time() - t)
+
+    return report(latencies, time.time() - start, errors)
@@ -0,0 +1,157 @@
+import time
+import random
+import threading
+import requests
+import telepot
+from telepot.ratelimit import _clock
+
+
+# Methods that may be repeated without side effects. Others, e.g. sendMessage, are retried
+# only if the request is known not to have been carried out.
+IDEMPOTENT_METHODS = frozenset(['getMe',
+                                'getUserProfilePhotos',
+                                'getFile',
+                                'getUpdates',
+                                'setWebhook',
+                                'sendChatAction',])
+
+
+class CircuitOpen(telepot.TelepotException):
+    def __init__(self, retry_in):
+        super(CircuitOpen, self).__init__(retry_in)
+
+    # seconds until a trial request is allowed through
+    @property
+    def retry_in(self):
+        return self.args[0]
+
+
+# After `failure_threshold` consecutive outage errors, refuse all calls for `reset_timeout`
+# seconds. Then let one trial call through: success closes the circuit, failure opens it again.
+class CircuitBreaker(object):
+    def __init__(self, failure_threshold=5, reset_timeout=30):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._lock = threading.Lock()
+        self._failures = 0
+        self._opened_at = None
+        self._probing = False
+
+    @property
+    def is_open(self):
+        return self._opened_at is not None
+
+    # Raises `CircuitOpen` if the call should not be made. Returns True if it is the trial call.
+    def check(self):
+        with self._lock:
+            if self._opened_at is None:
+                return False
+
+            remaining = self._opened_at + self.reset_timeout - _clock()
+            if remaining > 0 or self._probing:
+                raise CircuitOpen(max(remaining, 0))
+
+            self._probing = True
+            return True
+
+    # The trial call was interrupted before it succeeded or failed. Let another one through.
+    def abort(self):
+        with self._lock:
+            self._probing = False
+
+    def success(self):
+        with self._lock:
+            self._failures = 0
+            self._opened_at = None
+            self._probing = False
+
+    def failure(self):
+        with self._lock:
+            self._failures += 1
+            if self._probing or self._failures >= self.failure_threshold:
+                self._opened_at = _clock()
+                self._probing = False
+
+
+# Retries API calls that fail for transient reasons:
+# - 429 Too Many Requests: wait `retry_after` seconds, then retry any method, because
+#   Telegram has refused the request outright.
+# - 5xx errors and network errors: wait a jittered, exponentially growing delay, then
+#   retry only if the method is in `methods`, or the request never left this machine.
+#
+# A policy holds a circuit breaker, so it should not be shared by several bots.
+class RetryPolicy(object):
+    network_errors = (requests.exceptions.ConnectionError, requests.exceptions.Timeout)
+    unsent_errors = (requests.exceptions.ConnectTimeout,)
+
+    def __init__(self, max_attempts=5, backoff=0.5, max_backoff=30, max_retry_after=60,
+                 methods=IDEMPOTENT_METHODS, failure_threshold=5, reset_timeout=30):
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.max_retry_after = max_retry_after
+        self.methods = methods
+        self.breaker = CircuitBreaker(failure_threshold, reset_timeout)
+
+    def _is_outage(self, e):
+        if isinstance(e, telepot.TelegramError):
+            return e.error_code is not None and e.error_code >= 500
+        elif isinstance(e, telepot.BadHTTPResponse):
+            return e.status >= 500
+        else:
+            return isinstance(e, self.network_errors)
+
+    def _backoff(self, attempt):
+        return random.uniform(0, min(self.max_backoff, self.backoff * 2**attempt))
+
+    # Seconds to wait before retrying, or None if the exception should propagate.
+    def _delay(self, method, attempt, e):
+        if attempt >= self.max_attempts:
+            return None
+
+        if isinstance(e, telepot.TelegramError) and e.error_code == 429:
+            if e.retry_after is None:
+                return self._backoff(attempt)
+            elif e.retry_after > self.max_retry_after:
+                return None
+            else:
+                return e.retry_after + random.uniform(0, self.backoff)
+
+        if self._is_outage(e) and (method in self.methods or isinstance(e, self.unsent_errors)):
+            return self._backoff(attempt)
+
+        return None
+
+    # Record the outcome of a failed attempt. Returns the delay before retrying, or None.
+    def _failed(self, method, attempt, e):
+        if self._is_outage(e):
+            self.breaker.failure()
+        else:
+            self.breaker.success()  # Telegram answered, it is alive
+
+        if self.breaker.is_open:
+            return None
+
+        return self._delay(method, attempt, e)
+
+    def call(self, method, func, *args, **kwargs):
+        attempt = 0
+        while 1:
+            trial = self.breaker.check()
+            try:
+                result = func(*args, **kwargs)
+            except Exception as e:
+                attempt += 1
+                delay = self._failed(method, attempt, e)
+                if delay is None:
+                    raise
+            except BaseException:
+                # Interrupted, e.g. by KeyboardInterrupt. Nothing is learned about Telegram.
+                if trial:
+                    self.breaker.abort()
+                raise
+            else:
+                self.breaker.success()
+                return result
+
+            time.sleep(delay)
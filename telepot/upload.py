@@ -0,0 +1,207 @@
+import io
+import os
+import sys
+import mmap
+import uuid
+import time
+import hashlib
+import telepot
+
+PY_3 = sys.version_info.major >= 3
+
+# Raw data that can be uploaded. In Python 2, `str` is taken to be a file_id, so wrap raw
+# data in a `bytearray` or `memoryview`.
+if PY_3:
+    _buffer_types = (bytes, bytearray, memoryview, mmap.mmap)
+    _text_types = (str, bytes)
+else:
+    _buffer_types = (bytearray, memoryview, mmap.mmap)
+    _text_types = (basestring,)
+
+
+class UploadTimeout(telepot.TelepotException):
+    pass
+
+
+def _isfile(f):
+    if PY_3:
+        return isinstance(f, io.IOBase)
+    else:
+        return isinstance(f, (file, io.IOBase))
+
+
+# Data to be uploaded, which may be a file object, bytes, a memoryview or a memory-mapped file.
+# - filename: name given to Telegram, taken from the file object if not supplied
+# - progress: function called with (bytes_sent, total_bytes) as the upload proceeds
+class InputFile(object):
+    def __init__(self, content, filename=None, progress=None):
+        if not (_isfile(content) or isinstance(content, _buffer_types)):
+            raise TypeError('Cannot upload this type of object: %s' % type(content))
+
+        self.content = content
+        self.progress = progress
+
+        if filename is None:
+            name = getattr(content, 'name', None)
+            filename = os.path.basename(name) if isinstance(name, str) else 'file'
+        self.filename = filename
+
+        # Every attempt starts reading from the same position.
+        if _isfile(content):
+            self._start = content.tell()
+            content.seek(0, os.SEEK_END)
+            self.size = content.tell() - self._start
+            content.seek(self._start)
+        else:
+            self._start = 0
+            self.size = _nbytes(content)
+
+        self._digest = None
+
+    def _view(self):
+        try:
+            view = memoryview(self.content)
+        except TypeError:
+            return None  # Python 2 mmap does not support memoryview
+
+        if PY_3 and view.format != 'B':
+            view = view.cast('B')
+        return view
+
+    def isfile(self):
+        return _isfile(self.content)
+
+    def rewind(self):
+        if _isfile(self.content):
+            self.content.seek(self._start)
+
+    # Yield the content in chunks of at most `chunk_size` bytes, without copying buffers.
+    def chunks(self, chunk_size):
+        if _isfile(self.content):
+            self.rewind()
+            while 1:
+                chunk = self.content.read(chunk_size)
+                if not chunk:
+                    return
+                yield chunk
+        else:
+            view = self._view()
+            for i in range(0, self.size, chunk_size):
+                yield view[i:i+chunk_size] if view is not None else self.content[i:i+chunk_size]
+
+    # SHA-256 of the content, in hex. A file is read through once, then rewound.
+    def digest(self, chunk_size=65536):
+        if self._digest is None:
+            h = hashlib.sha256()
+            for chunk in self.chunks(chunk_size):
+                h.update(chunk)
+            self.rewind()
+            self._digest = h.hexdigest()
+        return self._digest
+
+
+def _nbytes(buf):
+    if isinstance(buf, memoryview):
+        return len(buf) * buf.itemsize
+    return len(buf)
+
+def is_content(obj):
+    return isinstance(obj, InputFile) or _isfile(obj) or isinstance(obj, _buffer_types)
+
+# Key under which the file_id of `f`, sent as `filetype`, is cached
+def cache_key(f, filetype):
+    return '%s:%s' % (filetype, f.digest())
+
+# The file_id of what was just sent as `filetype`, or None if `msg` does not have it.
+# Of a photo's sizes, the largest (last) one is taken, so the photo is not shrunk when resent.
+def sent_file_id(msg, filetype):
+    f = msg.get(filetype) if isinstance(msg, dict) else None
+    if isinstance(f, list):
+        f = f[-1] if f else None
+    return f.get('file_id') if f else None
+
+# Whether Telegram has refused a cached file_id, so the content has to be uploaded again.
+def file_id_refused(e):
+    return (isinstance(e, telepot.TelegramError) and e.error_code == 400 and
+            'file' in (e.description or '').lower())
+
+
+def _encode(s):
+    return s.encode('utf-8') if not isinstance(s, bytes) else s
+
+# Build the multipart/form-data envelope around the files. Returns (boundary, list of parts),
+# where each part is either bytes or an `InputFile`.
+def multipart(fields, files):
+    boundary = uuid.uuid4().hex
+    parts = []
+
+    for name, value in fields.items():
+        parts.append(_encode('--%s\r\nContent-Disposition: form-data; name="%s"\r\n\r\n' % (boundary, name)) +
+                     _encode(value if isinstance(value, _text_types) else str(value)) +
+                     b'\r\n')
+
+    for name, f in files.items():
+        parts.append(_encode('--%s\r\nContent-Disposition: form-data; name="%s"; filename="%s"\r\n'
+                             'Content-Type: application/octet-stream\r\n\r\n' % (boundary, name, f.filename.replace('"', '\\"'))))
+        parts.append(f)
+        parts.append(b'\r\n')
+
+    parts.append(_encode('--%s--\r\n' % boundary))
+    return boundary, parts
+
+def length(parts):
+    return sum([p.size if isinstance(p, InputFile) else len(p) for p in parts])
+
+
+# A multipart/form-data request body that is read piece by piece, so a large file is never
+# held in memory as a whole. Raises `UploadTimeout` if reading goes on past `deadline`.
+class MultipartStream(object):
+    def __init__(self, fields, files, chunk_size=65536, deadline=None):
+        self.boundary, self._parts = multipart(fields, files)
+        self.content_type = 'multipart/form-data; boundary=%s' % self.boundary
+        self.length = length(self._parts)
+        self._chunk_size = chunk_size
+        self._deadline = deadline
+        self._chunks = self._generate()
+        self._pending = None
+
+    def __len__(self):
+        return self.length
+
+    def _generate(self):
+        for p in self._parts:
+            if isinstance(p, InputFile):
+                sent = 0
+                for chunk in p.chunks(self._chunk_size):
+                    yield chunk
+                    sent += len(chunk)
+                    if p.progress:
+                        p.progress(sent, p.size)
+            else:
+                yield p
+
+    def __iter__(self):
+        while 1:
+            chunk = self.read(self._chunk_size)
+            if not chunk:
+                return
+            yield chunk
+
+    def read(self, size=-1):
+        if self._deadline is not None and time.time() > self._deadline:
+            raise UploadTimeout()
+
+        if not self._pending:
+            chunk = next(self._chunks, None)
+            if chunk is None:
+                return b''
+
+            # Slicing a memoryview does not copy.
+            self._pending = memoryview(chunk) if isinstance(chunk, bytes) else chunk
+
+        if size is None or size < 0 or size >= len(self._pending):
+            chunk, self._pending = self._pending, None
+        else:
+            chunk, self._pending = self._pending[:size], self._pending[size:]
+
+        return chunk
@@ -0,0 +1,124 @@
+import ssl
+import threading
+import traceback
+import telepot.codec
+import telepot.executor
+
+try:
+    from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+    from SocketServer import ThreadingMixIn
+except ImportError:
+    from http.server import HTTPServer, BaseHTTPRequestHandler
+    from socketserver import ThreadingMixIn
+
+# Largest request body accepted. Updates are much smaller.
+MAX_BODY_SIZE = 1048576
+
+
+class _ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+def _make_handler(server):
+    class Handler(BaseHTTPRequestHandler):
+        # Telegram keeps connections alive between updates.
+        protocol_version = 'HTTP/1.1'
+
+        def log_message(self, format, *args):
+            pass
+
+        def _respond(self, status):
+            self.send_response(status)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+
+        def do_POST(self):
+            if self.path.split('?')[0] != server.path:
+                self.close_connection = True
+                return self._respond(404)
+
+            try:
+                length = int(self.headers.get('Content-Length'))
+            except (TypeError, ValueError):
+                self.close_connection = True
+                return self._respond(411)
+
+            if length > MAX_BODY_SIZE:
+                self.close_connection = True
+                return self._respond(413)
+
+            try:
+                update = server.codec.loads(self.rfile.read(length))
+            except ValueError:
+                return self._respond(400)
+
+            if not isinstance(update, dict):
+                return self._respond(400)
+
+            # Acknowledge right away. Updates are handled on another thread.
+            server.put(update)
+            self._respond(200)
+
+        def do_GET(self):
+            self.close_connection = True
+            self._respond(405)
+
+    return Handler
+
+
+# Receives updates posted by Telegram to `path`, and passes each update's message to
+# `callback` on one of `workers` threads. Messages of a chat always go to the same thread,
+# so they are handled in order of arrival. Requests are acknowledged as soon as the update
+# is queued, so a slow callback does not hold up Telegram. Serves HTTPS if `certfile` is given.
+#
+# Telegram is not told about the webhook. Call `bot.setWebhook()` for that.
+class WebhookServer(object):
+    def __init__(self, path, callback, host='', port=8443, certfile=None, keyfile=None, codec=None, workers=1, maxsize=0):
+        self.path = path if path.startswith('/') else '/' + path
+        self.codec = codec if codec is not None else telepot.codec.get()
+        self._callback = callback
+        self._workers = workers
+        self._maxsize = maxsize
+        self._executor = None
+
+        self._httpd = _ThreadingHTTPServer((host, port), _make_handler(self))
+
+        if certfile:
+            context = ssl.SSLContext(getattr(ssl, 'PROTOCOL_TLS_SERVER', ssl.PROTOCOL_SSLv23))
+            context.load_cert_chain(certfile, keyfile)
+            self._httpd.socket = context.wrap_socket(self._httpd.socket, server_side=True)
+
+        self._thread = None
+
+    # (host, port) the server is listening on
+    @property
+    def address(self):
+        return self._httpd.server_address
+
+    def put(self, update):
+        # Updates this version does not understand are acknowledged, so they are not sent again.
+        if 'message' in update:
+            self._executor.submit(telepot.executor.chat_key(update['message']), self._handle, update)
+
+    def _handle(self, update):
+        try:
+            self._callback(update['message'])
+        except:
+            # Localize the error so the worker thread can keep going.
+            traceback.print_exc()
+
+    def start(self):
+        self._executor = telepot.executor.OrderedExecutor(self._workers, -(-self._maxsize // self._workers))
+
+        t = threading.Thread(target=self._httpd.serve_forever)
+        t.daemon = True
+        t.start()
+        self._thread = t
+
+    # Stop accepting updates, and wait for those received to be handled.
+    def stop(self):
+        self._httpd.shutdown()
+        self._httpd.server_close()
+        self._thread.join()
+        self._executor.shutdown(wait=True)
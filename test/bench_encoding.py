@@ -0,0 +1,59 @@
+# coding=utf8
+
+import sys
+import json
+import timeit
+import requests
+import telepot
+
+"""
+This script measures the CPU time spent preparing a `sendMessage()` request carrying a
+custom keyboard, before and after moving parameters into the request body and caching
+serialized keyboards. No request is actually sent.
+
+Run it by:
+$ python bench_encoding.py [number_of_calls]
+"""
+
+N = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+
+URL = 'https://api.telegram.org/bot123:ABC/sendMessage'
+
+keyboard = {'keyboard': [['Yes', 'No'], ['Maybe', 'Maybe not'], ['1', '2', '3', '4', '5'], ['6', '7', '8', '9', '0']],
+            'resize_keyboard': True,
+            'one_time_keyboard': True}
+
+text = 'A reasonably long message, the kind a bot sends all day long. ' * 8
+
+def params():
+    return {'chat_id': 12345678, 'text': text, 'parse_mode': None, 'disable_web_page_preview': None, 'reply_to_message_id': None, 'reply_markup': keyboard}
+
+# How parameters were encoded before: re-serialize everything, put it in the URL
+def old_rectify(params):
+    return {key: value if type(value) not in [dict, list] else json.dumps(value, separators=(',',':')) for key,value in params.items() if value is not None}
+
+def old():
+    requests.Request('POST', URL, params=old_rectify(params())).prepare()
+
+plain_bot = telepot.Bot('123:ABC')
+cached_bot = telepot.Bot('123:ABC', markup_cache_size=128)
+
+def new_uncached():
+    requests.Request('POST', URL, data=plain_bot._rectify(params())).prepare()
+
+def new_cached():
+    requests.Request('POST', URL, data=cached_bot._rectify(params())).prepare()
+
+def rectify_old():
+    old_rectify(params())
+
+def rectify_cached():
+    cached_bot._rectify(params())
+
+for name, func in [('rectify, before', rectify_old),
+                   ('rectify, cached keyboard', rectify_cached),
+                   ('prepare request, before (URL query)', old),
+                   ('prepare request, body', new_uncached),
+                   ('prepare request, body + cached keyboard', new_cached),]:
+    seconds = min(timeit.repeat(func, number=N, repeat=3))
+    print('%-42s %6.2f us/call' % (name, seconds / N * 1e6))
@@ -0,0 +1,51 @@
+# coding=utf8
+
+import os
+import sys
+import mmap
+import shutil
+import tempfile
+import telepot
+import telepot.cache
+from telepot.fakeapi import FakeBotAPI
+
+"""
+This script checks that `downloadFile()` writes into buffers, a bytearray and an mmap, both
+when downloading and when copying from a `MediaCache`. Before the fix, releasing the buffer
+failed on Python 2.7, whose memoryview has no `release()`.
+
+Run it by:
+$ python regress_buffer.py
+"""
+
+TOKEN = '123:ABC'
+content = os.urandom(100000)
+
+tmpdir = tempfile.mkdtemp()
+api = FakeBotAPI()
+api.start()
+try:
+    file_id = api.add_file(content)
+    bot = telepot.Bot(TOKEN, base_url=api.url, media_cache=telepot.cache.MediaCache(os.path.join(tmpdir, 'media')))
+
+    results = []
+    for source in ['download', 'cache']:
+        buf = bytearray(len(content))
+        bot.downloadFile(file_id, buf)
+        results.append(('bytearray, %s' % source, bytes(buf) == content))
+
+        m = mmap.mmap(-1, len(content))
+        bot.downloadFile(file_id, m)
+        results.append(('mmap, %s' % source, m[:] == content))
+        m.close()
+
+    for name, ok in results:
+        print('%-20s %s' % (name, 'OK' if ok else 'FAILED'))
+
+    ok = all([ok for name, ok in results])
+    print('OK' if ok else 'FAILED')
+finally:
+    api.stop()
+    shutil.rmtree(tmpdir)
+
+sys.exit(0 if ok else 1)
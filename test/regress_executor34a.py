@@ -0,0 +1,55 @@
+# coding=utf8
+
+import sys
+import asyncio
+import telepot.async.executor
+
+"""
+This script checks that a lane of `telepot.async.executor.OrderedExecutor` keeps going when
+the caller cancels a future it returned, e.g. with `asyncio.wait_for()`. Before the fix,
+setting the result of the cancelled future raised `InvalidStateError` and ended the lane,
+so later work on it never ran.
+
+Run it by:
+$ python3 regress_executor34a.py
+"""
+
+loop = asyncio.get_event_loop()
+
+@asyncio.coroutine
+def slow(x):
+    yield from asyncio.sleep(0.2)
+    return x
+
+@asyncio.coroutine
+def failing():
+    yield from asyncio.sleep(0.2)
+    raise ValueError('expected')
+
+@asyncio.coroutine
+def main():
+    executor = telepot.async.executor.OrderedExecutor(lanes=1)
+
+    # Cancel futures whose work is already running, one succeeding, one failing.
+    for fn, args in [(slow, (1,)), (failing, ())]:
+        f = yield from executor.submit('key', fn, *args)
+        try:
+            yield from asyncio.wait_for(f, 0.05)
+        except asyncio.TimeoutError:
+            pass
+
+    # The same lane must still carry out later work.
+    f = yield from executor.submit('key', slow, 2)
+    result = yield from asyncio.wait_for(f, 2)
+
+    yield from executor.shutdown()
+    return result
+
+try:
+    result = loop.run_until_complete(main())
+except asyncio.TimeoutError:
+    result = None
+
+print('later submit: %s' % result)
+print('OK' if result == 2 else 'FAILED')
+sys.exit(0 if result == 2 else 1)
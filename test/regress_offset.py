@@ -0,0 +1,101 @@
+# coding=utf8
+
+import os
+import sys
+import time
+import shutil
+import tempfile
+import threading
+import telepot
+import telepot.offset
+from telepot.fakeapi import FakeBotAPI
+
+"""
+This script checks that a slow handler does not hold up fetching updates when the offset
+is kept in a store. One handler takes 6 seconds, while 150 updates wait to be fetched.
+The rest should be fetched within a few getUpdates() calls and handled, except those that
+share the slow one's worker. Before the fix, polling kept fetching the same 100 updates from
+the slow one on, and about half as many were handled.
+
+Then it simulates a crash, while the slow update is still being handled: a new bot, with the
+same store, polls a new server, which has forgotten every update fetched. The slow update,
+and those stuck behind it, should be kept in the store and handled by the new bot. Before
+the fix, only the offset was kept, and they were lost.
+
+Run it by:
+$ python regress_offset.py
+"""
+
+TOKEN = '123:ABC'
+N = 150
+
+handled = []
+lock = threading.Lock()
+
+def handle(msg):
+    if msg['text'] == 'slow':
+        time.sleep(6)
+    with lock:
+        handled.append(msg['message_id'])
+
+tmpdir = tempfile.mkdtemp()
+try:
+    path = os.path.join(tmpdir, 'offset.json')
+    store = telepot.offset.FileOffsetStore(path)
+
+    # Left running, along with the bots' threads, until the script exits.
+    api = FakeBotAPI()
+    api.start()
+
+    # A different chat each, so no update waits for the slow one's lane.
+    slow = api.message(TOKEN, 1, 'slow')
+    for i in range(N - 1):
+        api.message(TOKEN, i + 2, 'fast')
+
+    bot = telepot.Bot(TOKEN, base_url=api.url)
+    bot.notifyOnMessage(handle, timeout=1, workers=4, offset_store=store)
+
+    time.sleep(4)
+
+    with lock:
+        count = len(handled)
+        unhandled = set(range(1, N + 1)) - set(handled)
+    calls = api.calls().get('getUpdates', 0)
+    offset, updates = store.load()
+    kept = set(u['message']['message_id'] for u in updates)
+
+    print('handled after 4s: %d of %d' % (count, N))
+    print('getUpdates calls: %d' % calls)
+    print('updates kept: %d (slow update among them: %s)' % (len(kept), slow['message']['message_id'] in kept))
+
+    ok = count >= N * 2 // 3 and calls <= 10 and slow['message']['message_id'] in kept and unhandled <= kept
+
+    # Restart, against a server that has forgotten every update fetched
+    redelivered = []
+
+    def handle_again(msg):
+        with lock:
+            redelivered.append(msg['message_id'])
+
+    api2 = FakeBotAPI()
+    api2.start()
+
+    bot2 = telepot.Bot(TOKEN, base_url=api2.url)
+    bot2.notifyOnMessage(handle_again, timeout=1, offset_store=telepot.offset.FileOffsetStore(path))
+
+    time.sleep(1)
+
+    with lock:
+        again = set(redelivered)
+
+    print('handled after restart: %d (slow update among them: %s)' % (len(again), slow['message']['message_id'] in again))
+
+    ok = ok and again == kept
+    print('OK' if ok else 'FAILED')
+finally:
+    shutil.rmtree(tmpdir)
+
+# The bots' threads never stop. Exit without tearing down the interpreter under them, which
+# Python 2 complains about.
+sys.stdout.flush()
+os._exit(0 if ok else 1)